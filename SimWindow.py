@@ -18,20 +18,38 @@ The code is adapted from:
 https://github.com/BilHim/trafficSimulator
 """
 
-import random
+import time
 from typing import List, Tuple
 
 import dearpygui.dearpygui as dpg
 import numpy as np
 
+from frame_profiler import UNTIMED, FrameProfiler
+from offscreen import screen_to_world, world_to_screen
+from road_index import TileGrid, find_bridges
+from road_map import CarSet, RoadMap
+
 
 class SimWindow:
+    # Culling and level of detail
+    grid_min_pixels = 8  # finest grid spacing on screen, bounds the grid lines drawn
+    tile_size = 128  # side of a culling tile in world units
+    junction_min_radius = 1.5  # junction circles smaller than this (pixels) are skipped
+    road_lod_pixels = 8  # tiles smaller than this on screen are drawn as density cells
+    car_min_radius = 1  # cars smaller than this (pixels) are drawn as density cells
+    car_budget = 20000  # more visible cars than this are drawn as density cells
+    density_cell_pixels = 6  # side of a car density cell on screen
+    # Profiling
+    profile_panel_interval = 0.25  # seconds between refreshes of the profiling panel
+
     def __init__(
         self,
         segs: List[Tuple[Tuple[int], Tuple[int]]],
         cars: List[Tuple[int]],
         speed: List[Tuple[int]] = None,
         draw_bridges: bool = False,
+        profile: bool = False,
+        trace_file: str = None,
     ):
         """
         Each instance of this class maintains a window
@@ -42,10 +60,12 @@ class SimWindow:
         ----------
         segs: List[((int,int),(int,int))]
         The segs list requires to identify the begining and the end of each segment.
+        A RoadMap (or an array) is used without a copy, a list is converted to a RoadMap.
         No check is implemented to make sure the segments are connected.
 
         cars: List[(int,int)]
         The cars list requires to identify the location of each car.
+        The positions of a CarSet are shared with the window, not copied.
         No check is implemented to make sure the cars are placed on the road.
 
         speed: List[(int,int)] Optional and not required for phase 1
@@ -56,6 +76,14 @@ class SimWindow:
         draw_bridges: bool Optional
         This function show crossing (bridges) that do not correspond to segments' junctions
 
+        profile: bool Optional
+        Time the phases of every frame and show them in the Profiling panel.
+        It can also be switched on and off from the panel.
+
+        trace_file: str Optional
+        File the per-frame trace is written to, as CSV if it ends with .csv and as JSON
+        otherwise, when the window is closed or with the Export trace button.
+
         """
 
         self.zoom = 2
@@ -66,13 +94,35 @@ class SimWindow:
         self.zoom_speed = 1
         self.draw_bridges = draw_bridges
 
+        # Retained drawing state: items are created once and updated in place
+        self._drawn_view = None
+        self._road_view = None
+        self._drawn_zoom = self.zoom
+        self._roads_dirty = True
+        self._tiles = None
+        self._tile_nodes = {}
+        self._visible_tiles = set()
+        self._bridges = None
+        self._bridge_items = []
+        self._bridge_line_items = []
+        self._vehicle_items = []
+        self._vehicle_density_items = []
+        self._drawn_vehicles = np.empty((0, 2))
+
+        # Profiling: phase timers are no-ops unless profiling is on
+        self.profiling = profile
+        self.profiler = FrameProfiler()
+        self.trace_file = trace_file
+        self._profile_panel_time = 0.0
+
         self._setup()
         self._setup_themes()
         self._create_windows()
         self._create_handlers()
         self._resize_windows()
-        self.segments = segs.copy()
-        self.vehicles = cars
+        self.segments = RoadMap.from_segments(segs)
+        # A CarSet is unwrapped so updatecar writes straight into its positions
+        self.vehicles = cars.positions if isinstance(cars, CarSet) else cars
         self.speed = speed
 
     def _setup(self):
@@ -115,6 +165,8 @@ class SimWindow:
 
         dpg.add_draw_node(tag="OverlayCanvas", parent="MainWindow")
         dpg.add_draw_node(tag="Canvas", parent="MainWindow")
+        dpg.add_draw_node(tag="VehicleCanvas", parent="MainWindow")
+        dpg.add_draw_node(tag="BridgeCanvas", parent="MainWindow")
 
         with dpg.window(
             tag="ControlsWindow",
@@ -150,6 +202,27 @@ class SimWindow:
                         default_value=self.offset[1],
                         callback=self._set_offset_zoom,
                     )
+            with dpg.collapsing_header(label="Profiling", default_open=self.profiling):
+                dpg.add_checkbox(
+                    tag="ProfileCheckbox",
+                    label="Time each frame",
+                    default_value=self.profiling,
+                    callback=self._set_profiling,
+                )
+                dpg.add_text("", tag="ProfileFps")
+                dpg.add_text("", tag="ProfilePhases")
+                dpg.add_text("", tag="ProfileItems")
+                dpg.add_button(label="Export trace", callback=self._export_trace)
+                dpg.add_text("", tag="ProfileStatus")
+
+    def set_segments(self, segs: List[Tuple[Tuple[int], Tuple[int]]]):
+        """
+        Replace the segments of the map.
+        The static road layer (and the bridges) are rebuilt on the next frame.
+        """
+        self.segments = RoadMap.from_segments(segs)
+        self._roads_dirty = True
+        self._bridges = None
 
     def _set_offset_zoom(self):
         self.zoom = dpg.get_value("ZoomSlider")
@@ -215,10 +288,57 @@ class SimWindow:
         """
         dpg.show_viewport()
         while dpg.is_dearpygui_running():
+            profiling = self.profiling
+            if profiling:
+                self.profiler.start_frame()
             self._render_loop(updatecar)
-            dpg.render_dearpygui_frame()
+            with self._timer("render"):
+                dpg.render_dearpygui_frame()
+            if profiling:
+                self.profiler.end_frame()
+        if self.trace_file is not None and self.profiler.frames:
+            self.profiler.export(self.trace_file)
         dpg.destroy_context()
 
+    def _timer(self, phase):
+        # Times a phase of the frame when profiling, otherwise a shared no-op
+        return self.profiler.phase(phase) if self.profiling else UNTIMED
+
+    def _set_profiling(self, sender, app_data):
+        self.profiling = app_data
+
+    def _export_trace(self):
+        file_path = self.trace_file or "frame_trace.csv"
+        frames = self.profiler.export(file_path)
+        dpg.set_value("ProfileStatus", f"Exported {frames} frames to {file_path}")
+
+    def _record_items(self):
+        # Number of items of each kind in the current frame
+        profiler = self.profiler
+        profiler.count("overlay", len(dpg.get_item_children("OverlayCanvas", 2)))
+        profiler.count("road_tiles", len(self._visible_tiles))
+        profiler.count("road_cells", len(dpg.get_item_children("Canvas", 2)))
+        profiler.count("bridges", len(self._bridge_items) + len(self._bridge_line_items))
+        profiler.count("vehicles", len(self._vehicle_items))
+        profiler.count("vehicle_cells", len(self._vehicle_density_items))
+
+    def _update_profile_panel(self):
+        now = time.perf_counter()
+        if now - self._profile_panel_time < self.profile_panel_interval:
+            return
+        self._profile_panel_time = now
+        averages = self.profiler.averages()
+        dpg.set_value("ProfileFps", f"FPS: {self.profiler.fps():.1f}")
+        dpg.set_value(
+            "ProfilePhases",
+            "\n".join(f"{name:<10} {seconds * 1000:7.2f} ms" for name, seconds in averages.items()),
+        )
+        frames = self.profiler.frames
+        items = frames[-1]["items"] if frames else {}
+        dpg.set_value(
+            "ProfileItems", "\n".join(f"{name:<13} {count:>7}" for name, count in items.items())
+        )
+
     def _update_offset_zoom_slider(self):
         dpg.set_value("ZoomSlider", self.zoom)
         dpg.set_value("OffsetXSlider", self.offset[0])
@@ -259,43 +379,51 @@ class SimWindow:
             parent="OverlayCanvas",
         )
 
+    def _grid_unit(self, unit=10):
+        # Coarsen the grid by factors of 5 until lines are grid_min_pixels apart
+        while unit * self.zoom < self.grid_min_pixels:
+            unit *= 5
+        return unit
+
     def _draw_grid(self, unit=10, opacity=50):
+        # All lines of one direction are drawn as a single zigzag polyline whose
+        # connecting strokes lie outside the canvas
         x_start, y_start = self._to_world(0, 0)
         x_end, y_end = self._to_world(self._canvas_width, self._canvas_height)
 
-        n_x = int(x_start / unit)
-        n_y = int(y_start / unit)
-        m_x = int(x_end / unit) + 1
-        m_y = int(y_end / unit) + 1
+        xs = unit * np.arange(np.ceil(x_start / unit), np.floor(x_end / unit) + 1)
+        ys = unit * np.arange(np.ceil(y_start / unit), np.floor(y_end / unit) + 1)
+        xs = self._canvas_width / 2 + (xs + self.offset[0]) * self.zoom
+        ys = self._canvas_height / 2 + (ys + self.offset[1]) * self.zoom
 
-        for i in range(n_x, m_x):
-            dpg.draw_line(
-                self._to_screen(unit * i, y_start - 10 / self.zoom),
-                self._to_screen(unit * i, y_end + 10 / self.zoom),
-                thickness=1,
-                color=(0, 0, 0, opacity),
-                parent="OverlayCanvas",
-            )
-
-        for i in range(n_y, m_y):
-            dpg.draw_line(
-                self._to_screen(x_start - 10 / self.zoom, unit * i),
-                self._to_screen(x_end + 10 / self.zoom, unit * i),
+        for lines, low, high, vertical in (
+            (xs, -10, self._canvas_height + 10, True),
+            (ys, -10, self._canvas_width + 10, False),
+        ):
+            if len(lines) == 0:
+                continue
+            ends = np.empty((len(lines), 2))
+            ends[0::2] = (low, high)
+            ends[1::2] = (high, low)
+            along = np.repeat(lines, 2)
+            across = ends.ravel()
+            points = np.column_stack((along, across) if vertical else (across, along))
+            dpg.draw_polyline(
+                points.tolist(),
                 thickness=1,
                 color=(0, 0, 0, opacity),
                 parent="OverlayCanvas",
             )
 
     def _to_screen(self, x, y):
-        return (
-            self._canvas_width / 2 + (x + self.offset[0]) * self.zoom,
-            self._canvas_height / 2 + (y + self.offset[1]) * self.zoom,
+        # Shared with OffscreenRenderer, so exported frames match the window
+        return world_to_screen(
+            x, y, self.zoom, self.offset, self._canvas_width, self._canvas_height
         )
 
     def _to_world(self, x, y):
-        return (
-            (x - self._canvas_width / 2) / self.zoom - self.offset[0],
-            (y - self._canvas_height / 2) / self.zoom - self.offset[1],
+        return screen_to_world(
+            x, y, self.zoom, self.offset, self._canvas_width, self._canvas_height
         )
 
     def _apply_transformation(self):
@@ -304,128 +432,266 @@ class SimWindow:
         )
         translate = dpg.create_translation_matrix(self.offset)
         scale = dpg.create_scale_matrix([self.zoom, self.zoom])
-        dpg.apply_transform("Canvas", screen_center * scale * translate)
+        transform = screen_center * scale * translate
+        for canvas in ("Canvas", "VehicleCanvas", "BridgeCanvas"):
+            dpg.apply_transform(canvas, transform)
+        for tile in self._visible_tiles:
+            for node in self._tile_nodes[tile][:2]:
+                dpg.apply_transform(node, transform)
+
+    def _visible_rect(self, margin=2.5):
+        # World rectangle shown on the canvas, widened by margin world units
+        x_min, y_min = self._to_world(0, 0)
+        x_max, y_max = self._to_world(self._canvas_width, self._canvas_height)
+        return x_min - margin, y_min - margin, x_max + margin, y_max + margin
+
+    def _draw_overlay(self):
+        # Background, axes and grid only depend on the view, redraw them when it changes
+        view = (self.zoom, self.offset, self._canvas_width, self._canvas_height)
+        if view == self._drawn_view:
+            return
+        self._drawn_view = view
+        dpg.delete_item("OverlayCanvas", children_only=True)
+        self._draw_bg()
+        self._draw_axes()
+        unit = self._grid_unit(10)
+        self._draw_grid(unit=unit)
+        self._draw_grid(unit=5 * unit)
+
+    def _rescale_items(self):
+        # Thickness and radius are not affected by the canvas transform,
+        # road tiles are rescaled when they are shown (see _show_tile)
+        for item in self._bridge_items + self._vehicle_items:
+            dpg.configure_item(item, radius=2.5 * self.zoom)
+        for item in self._bridge_line_items:
+            dpg.configure_item(item, thickness=5 * self.zoom)
+        self._drawn_zoom = self.zoom
 
     def _draw_segments(self):
-        for segment in self.segments:
-            dpg.draw_polyline(
-                segment, color=(180, 180, 220), thickness=5 * self.zoom, parent="Canvas"
+        # Index the roads by tile, the drawings of a tile are only made once it is in view
+        for road_node, junction_node, _ in self._tile_nodes.values():
+            dpg.delete_item(road_node)
+            dpg.delete_item(junction_node)
+        dpg.delete_item("Canvas", children_only=True)
+        self._tiles = TileGrid(self.segments, self.tile_size)
+        self._tile_nodes = {}
+        self._visible_tiles = set()
+        self._road_view = None
+
+    def _update_roads(self):
+        # Culling and level of detail, only recomputed when the view changes
+        view = (self.zoom, self.offset, self._canvas_width, self._canvas_height)
+        if view == self._road_view:
+            return
+        self._road_view = view
+
+        x_min, y_min, x_max, y_max = self._visible_rect()
+        dpg.delete_item("Canvas", children_only=True)
+        if self.tile_size * self.zoom >= self.road_lod_pixels:
+            visible = set(
+                self._tiles.tiles_in_rect(x_min, y_min, x_max, y_max).tolist()
             )
-            dpg.draw_circle(
-                segment[0],
-                2.5 * self.zoom,
-                color=(220, 220, 220),
-                fill=(220, 220, 220),
-                thickness=0,
-                parent="Canvas",
+        else:
+            visible = set()
+            self._draw_road_density(x_min, y_min, x_max, y_max)
+
+        for tile in self._visible_tiles - visible:
+            for node in self._tile_nodes[tile][:2]:
+                dpg.configure_item(node, show=False)
+        show_junctions = 2.5 * self.zoom >= self.junction_min_radius
+        for tile in visible:
+            self._show_tile(tile, show_junctions)
+        self._visible_tiles = visible
+
+    def _show_tile(self, tile, show_junctions):
+        if tile not in self._tile_nodes:
+            road_node = dpg.add_draw_node(parent="MainWindow", before="VehicleCanvas")
+            junction_node = dpg.add_draw_node(
+                parent="MainWindow", before="VehicleCanvas"
             )
-            dpg.draw_circle(
-                segment[1],
-                2.5 * self.zoom,
-                color=(220, 220, 220),
-                fill=(220, 220, 220),
+            ends = self.segments.points[self._tiles.segments_in_tile(tile)]
+            for segment in ends.tolist():
+                dpg.draw_polyline(
+                    segment,
+                    color=(180, 180, 220),
+                    thickness=5 * self.zoom,
+                    parent=road_node,
+                )
+                for end in segment:
+                    dpg.draw_circle(
+                        end,
+                        2.5 * self.zoom,
+                        color=(220, 220, 220),
+                        fill=(220, 220, 220),
+                        thickness=0,
+                        parent=junction_node,
+                    )
+            self._tile_nodes[tile] = [road_node, junction_node, self.zoom]
+
+        road_node, junction_node, zoom = self._tile_nodes[tile]
+        if zoom != self.zoom:
+            for item in dpg.get_item_children(road_node, 2):
+                dpg.configure_item(item, thickness=5 * self.zoom)
+            for item in dpg.get_item_children(junction_node, 2):
+                dpg.configure_item(item, radius=2.5 * self.zoom)
+            self._tile_nodes[tile][2] = self.zoom
+        dpg.configure_item(road_node, show=True)
+        dpg.configure_item(junction_node, show=show_junctions)
+
+    def _draw_road_density(self, x_min, y_min, x_max, y_max):
+        # Zoomed out: tiles are merged into cells of at least road_lod_pixels,
+        # each drawn as one rectangle shaded by the length of road it holds
+        cell = self.tile_size
+        while cell * self.zoom < self.road_lod_pixels:
+            cell *= 2
+        tiles = self._tiles.tiles_in_rect(x_min, y_min, x_max, y_max)
+        if len(tiles) == 0:
+            return
+        cells = np.floor(
+            self._tiles.cells[tiles] * (self.tile_size / cell)
+        ).astype(np.int64)
+        cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+        lengths = np.bincount(inverse.ravel(), weights=self._tiles.lengths[tiles])
+        alpha = np.clip(lengths / cell * 60, 40, 255).astype(int)
+        for (i, j), a in zip(cells.tolist(), alpha.tolist()):
+            dpg.draw_rectangle(
+                (i * cell, j * cell),
+                ((i + 1) * cell, (j + 1) * cell),
                 thickness=0,
+                fill=(180, 180, 220, a),
                 parent="Canvas",
             )
 
     def _draw_bridge_intersections(self):
-        bridges = []
-        for i in range(len(self.segments)):
-            pp = self.segments[i]
-            x0 = pp[0][0]
-            x1 = pp[1][0]
-            y0 = pp[0][1]
-            y1 = pp[1][1]
-            dx = x0 - x1
-            dy = y0 - y1
-            for j in range(i + 1, len(self.segments)):
-                pp = self.segments[j]
-                X0 = pp[0][0]
-                X1 = pp[1][0]
-                Y0 = pp[0][1]
-                Y1 = pp[1][1]
-                dX = X0 - X1
-                dY = Y0 - Y1
-
-                det = dx * dY - dy * dX
-                dt1 = dY * (x0 - X1) - dX * (y0 - Y1)
-                dt2 = dx * (Y0 - y1) - dy * (X0 - x1)
-                if det != 0:
-                    t1 = 1 / det * dt1
-                    t2 = 1 / det * dt2
-                    if (t1 >= 0) and (t1 <= 1) and (t2 >= 0) and (t2 <= 1):
-                        if ((t1 > 0) and (t1 < 1)) or ((t2 > 0) and (t2 < 1)):
-                            bridges.append(((x1 - x0) * t1 + x0, (y1 - y0) * t1 + y0))
-                else:
-                    if (dt1 == 0) and (dt2 == 0):
-                        if self.segments[i][0][0] == self.segments[i][1][0]:
-                            p1 = [
-                                self.segments[i][0][1],
-                                self.segments[i][1][1],
-                                self.segments[j][0][1],
-                                self.segments[j][1][1],
-                            ]
-                            p1.sort()
-                            p1 = p1[1:3]
-                            for k in range(p1[0], p1[1]):
-                                bridges.append((self.segments[i][0][0], k))
-                        if self.segments[i][0][1] == self.segments[i][1][1]:
-                            p1 = [
-                                self.segments[i][0][0],
-                                self.segments[i][1][0],
-                                self.segments[j][0][0],
-                                self.segments[j][1][0],
-                            ]
-                            p1.sort()
-                            p1 = p1[1:3]
-                            for k in range(p1[0], p1[1]):
-                                bridges.append((k, self.segments[i][0][1]))
-        for wp in bridges:
+        # Crossings only depend on the segments: computed once by an O(n log n)
+        # sweep and cached until set_segments is called
+        if self._bridges is None:
+            self._bridges = find_bridges(self.segments)
+        points, overlaps = self._bridges
+
+        dpg.delete_item("BridgeCanvas", children_only=True)
+        self._bridge_items = [
             dpg.draw_circle(
                 wp,
                 2.5 * self.zoom,
                 color=(0, 0, 0),
                 fill=(0, 0, 0),
                 thickness=0,
-                parent="Canvas",
+                parent="BridgeCanvas",
+            )
+            for wp in points
+        ]
+        self._bridge_line_items = [
+            dpg.draw_polyline(
+                overlap,
+                color=(0, 0, 0),
+                thickness=5 * self.zoom,
+                parent="BridgeCanvas",
             )
+            for overlap in overlaps
+        ]
 
     def _draw_vehicles(self):
-        for car in self.vehicles:
-            dpg.draw_circle(
-                car,
-                2.5 * self.zoom,
-                color=(255, 0, 0),
-                fill=(255, 0, 0),
-                thickness=0,
-                parent="Canvas",
+        # Only cars in view are drawn, as density cells when they are too small or too many
+        cars = np.asarray(self.vehicles, dtype=float).reshape(-1, 2)
+        x_min, y_min, x_max, y_max = self._visible_rect()
+        in_view = (
+            (cars[:, 0] >= x_min)
+            & (cars[:, 0] <= x_max)
+            & (cars[:, 1] >= y_min)
+            & (cars[:, 1] <= y_max)
+        )
+        cars = cars[in_view]
+
+        for item in self._vehicle_density_items:
+            dpg.delete_item(item)
+        self._vehicle_density_items = []
+        if 2.5 * self.zoom < self.car_min_radius or len(cars) > self.car_budget:
+            self._sync_vehicle_circles(cars[:0])
+            self._draw_vehicle_density(cars, x_min, y_min)
+        else:
+            self._sync_vehicle_circles(cars)
+
+    def _sync_vehicle_circles(self, cars):
+        # Create, delete or move only the circles whose car changed since last frame
+        for car in cars[len(self._vehicle_items) :].tolist():
+            self._vehicle_items.append(
+                dpg.draw_circle(
+                    car,
+                    2.5 * self.zoom,
+                    color=(255, 0, 0),
+                    fill=(255, 0, 0),
+                    thickness=0,
+                    parent="VehicleCanvas",
+                )
+            )
+        for item in self._vehicle_items[len(cars) :]:
+            dpg.delete_item(item)
+        del self._vehicle_items[len(cars) :]
+
+        n = min(len(cars), len(self._drawn_vehicles))
+        moved = np.flatnonzero((cars[:n] != self._drawn_vehicles[:n]).any(axis=1))
+        for i in moved.tolist():
+            dpg.configure_item(self._vehicle_items[i], center=cars[i].tolist())
+        self._drawn_vehicles = cars.copy()
+
+    def _draw_vehicle_density(self, cars, x_min, y_min):
+        if len(cars) == 0:
+            return
+        cell = self.density_cell_pixels / self.zoom
+        cells = np.floor((cars - (x_min, y_min)) / cell).astype(np.int64)
+        cells, counts = np.unique(cells, axis=0, return_counts=True)
+        alpha = np.clip(80 + 40 * np.log2(counts), 80, 255).astype(int)
+        for (i, j), a in zip(cells.tolist(), alpha.tolist()):
+            self._vehicle_density_items.append(
+                dpg.draw_rectangle(
+                    (x_min + i * cell, y_min + j * cell),
+                    (x_min + (i + 1) * cell, y_min + (j + 1) * cell),
+                    thickness=0,
+                    fill=(255, 0, 0, a),
+                    parent="VehicleCanvas",
+                )
             )
 
     def _render_loop(self, updatecar):
-        ## Events
-        self._update_inertial_zoom()
-        self._update_offset_zoom_slider()
+        timer = self._timer
 
-        ## Remove old drawings
-        dpg.delete_item("OverlayCanvas", children_only=True)
-        dpg.delete_item("Canvas", children_only=True)
-
-        ## New drawings
-        self._draw_bg()
-        self._draw_axes()
-        self._draw_grid(unit=10)
-        self._draw_grid(unit=50)
-        self._draw_segments()
-        self._draw_vehicles()
-        if self.draw_bridges:
-            self._draw_bridge_intersections()
+        ## Events
+        with timer("events"):
+            self._update_inertial_zoom()
+            self._update_offset_zoom_slider()
+
+        ## Update drawings (static items are built once and kept between frames)
+        with timer("grid"):
+            self._draw_overlay()
+        if self._roads_dirty:
+            with timer("segments"):
+                self._draw_segments()
+            if self.draw_bridges:
+                with timer("bridges"):
+                    self._draw_bridge_intersections()
+            self._roads_dirty = False
+        with timer("segments"):
+            self._update_roads()
+        if self.zoom != self._drawn_zoom:
+            with timer("rescale"):
+                self._rescale_items()
+        with timer("vehicles"):
+            self._draw_vehicles()
 
         ## Apply transformations
-        self._apply_transformation()
+        with timer("transform"):
+            self._apply_transformation()
 
         ## Update simulation
         if updatecar != None:
-            updatecar(self.vehicles, self.speed, self.segments)
+            with timer("updatecar"):
+                updatecar(self.vehicles, self.speed, self.segments)
+
+        ## Profiling
+        if self.profiling:
+            self._record_items()
+            self._update_profile_panel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+#Non-interactive batch mode: generate or load, validate and simulate without prompts
+
+"""
+Runs the map_sim pipeline from the command line and writes the results as JSON.
+
+Examples:
+    python map_sim.py --segments 1000 --cars 500 --seed 7 --output run.json
+    python map_sim.py --segments 10000000 --grid --missing-group-rate 0.2 --output city.json
+    python map_sim.py --map-file map.txt --cars-file cars.txt --simulate 60 --cars-out end.txt
+    python map_sim.py --segments 100000 --grid --cars 20000 --simulate 30 --frames frames --frame-interval 0.1
+
+Exit status: 0 when the map and cars are valid (and the simulation ran), 1 when the
+map or the cars are invalid, 2 when the input cannot be used (missing file, bad size).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+
+import numpy as np
+
+import map_core
+from offscreen import OffscreenRenderer
+from sim_thread import SimulationThread
+from traffic import TrafficEngine
+
+EXIT_OK = 0
+EXIT_INVALID = 1
+EXIT_ERROR = 2
+
+
+def run_scenario(num_segments=None, map_file=None, num_cars=None, cars_file=None, seed=None,
+                 simulate=0.0, dt=0.1, speed=30.0, min_gap=0.0, snap=False, snap_distance=None,
+                 grid=False, block_size=100, missing_group_rate=0.1, arterial_spacing=10,
+                 frames=None, frame_interval=1.0, frame_size=(1280, 720)):
+    """
+    Runs one scenario: map, validation, cars, validation and an optional headless simulation.
+
+    Parameters:
+        num_segments (int): Number of segments of a random map (or use map_file).
+        map_file (str): Segment file to load instead of generating a map.
+        num_cars (int): Number of random cars (or use cars_file, or neither for no cars).
+        cars_file (str): Car file to load instead of generating cars.
+        seed (int): Seed of the random map and cars, None for a random run.
+        simulate (float): Simulated time to run the traffic for, 0 to skip the simulation.
+        dt (float): Simulation timestep.
+        speed (float): Speed of every car.
+        min_gap (float): Minimum distance kept between consecutive cars, 0 for none.
+        snap (bool): Move off-road cars to the nearest road before validating them.
+        snap_distance (float): Only move cars this close to a road, None for all.
+        grid (bool): Generate a grid city instead of a random loop (see map_core.generate_grid_city).
+        block_size (float): Size of the blocks of a grid city.
+        missing_group_rate (float): Share of the possible 3 x 3 block groups of a grid city that are missing.
+        arterial_spacing (int): Blocks between two arterials of a grid city.
+        frames (str): Folder for PNG frames of the whole map, None for no frames. A
+            simulation writes one frame at the start and one every frame_interval.
+        frame_interval (float): Simulated time between two frames.
+        frame_size (tuple): Width and height of the frames in pixels.
+
+    Returns:
+        dict: The scenario, its "status" ("ok", "invalid_map", "invalid_cars" or
+        "error"), the time of each stage in seconds, the messages printed by the
+        validators (or the error) and, after a simulation, the final car positions
+        under "positions".
+    """
+    result = {
+        "segments_requested": num_segments, "map_file": map_file,
+        "cars_requested": num_cars, "cars_file": cars_file,
+        "grid": grid, "seed": seed, "simulate": simulate, "status": "ok", "timings": {}, "messages": [],
+    }
+    map_seed, car_seed = (None, None) if seed is None else \
+        (int(s) for s in np.random.SeedSequence(seed).generate_state(2))
+
+    def stage(name, function, *args, **kwargs):
+        #Times one stage and keeps what it prints
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            value = function(*args, **kwargs)
+        result["timings"][name] = time.perf_counter() - start
+        result["messages"] += [line for line in output.getvalue().splitlines() if line.strip()]
+        return value
+
+    try:
+        if map_file is not None:
+            segments = stage("load_map", map_core.read_segments_from_file, map_file)
+        elif grid:
+            segments = stage("generate_map", map_core.generate_grid_city, num_segments, block_size=block_size,
+                             missing_group_rate=missing_group_rate, arterial_spacing=arterial_spacing, seed=map_seed)
+        else:
+            segments = stage("generate_map", map_core.generate_random_segments, num_segments, seed=map_seed)
+        result["segments"] = len(segments)
+        if len(segments) == 0 or not stage("validate_map", map_core.are_segments_connected, segments):
+            result["status"] = "invalid_map"
+            return result
+
+        if cars_file is not None:
+            cars = stage("load_cars", map_core.read_segments_from_file_cars, cars_file)
+        elif num_cars:
+            cars = stage("generate_cars", map_core.generate_random_cars, num_cars, segments, seed=car_seed)
+        else:
+            cars = []
+        result["cars"] = len(cars)
+        if snap and len(cars):
+            cars, result["snapped"] = stage("snap_cars", map_core.snap_cars_to_roads, cars, segments, snap_distance)
+        if len(cars) and not stage("validate_cars", map_core.validate_car_positions, cars, segments):
+            result["status"] = "invalid_cars"
+            return result
+
+        if simulate > 0 and len(cars):
+            def simulation():
+                engine = TrafficEngine.from_positions(
+                    segments, cars, speeds=speed, dt=dt, seed=car_seed, min_gap=min_gap)
+                runner = SimulationThread(engine, realtime=False)
+                if frames is None:
+                    return runner.advance(simulate), engine.positions
+                #The renderer reads the engine positions, which are updated in place
+                count = max(1, int(round(simulate / frame_interval)))
+                renderer = OffscreenRenderer(segments, engine.positions, *frame_size)
+                renderer.fit()
+                result["frames"] = len(renderer.record(frames, count + 1, lambda *_: runner.advance(simulate / count)))
+                return runner.steps, engine.positions
+            steps, positions = stage("simulate", simulation)
+            result["steps"] = steps
+            result["positions"] = positions
+        elif frames is not None:
+            renderer = OffscreenRenderer(segments, cars, *frame_size)
+            renderer.fit()
+            result["frames"] = len(stage("render", renderer.record, frames, 1))
+    except (OSError, ValueError, RuntimeError, MemoryError) as error:
+        #Bad input, a generator giving up (RuntimeError) or a size too large for memory
+        result["status"] = "error"
+        result["messages"].append(str(error).strip() or type(error).__name__)
+    finally:
+        result["timings"]["total"] = sum(result["timings"].values())
+    return result
+
+
+def exit_status(result):
+    """Exit status of the command line for a scenario result."""
+    if result["status"] == "ok":
+        return EXIT_OK
+    if result["status"] == "error":
+        return EXIT_ERROR
+    return EXIT_INVALID
+
+
+def _size(text):
+    """Parses "1280x720" into (1280, 720)."""
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    """
+    Command line entry point of the batch mode.
+
+    Returns:
+        int: The exit status.
+    """
+    parser = argparse.ArgumentParser(
+        prog="map_sim.py", description="Generate or load a map and cars, validate them and "
+        "optionally simulate the traffic, without prompts.")
+    road = parser.add_mutually_exclusive_group(required=True)
+    road.add_argument("--segments", type=int, help="number of segments of a random map (even, at least 4)")
+    road.add_argument("--map-file", help="segment file with lines x1,y1,x2,y2")
+    parser.add_argument("--grid", action="store_true", help="generate a grid city of about --segments segments")
+    parser.add_argument("--block-size", type=float, default=100, help="block size of a grid city")
+    parser.add_argument("--missing-group-rate", type=float, default=0.1, help="share of the possible 3x3 block groups of a grid city that are missing (1.0 removes about 24%% of the streets)")
+    parser.add_argument("--arterial-spacing", type=int, default=10, help="blocks between arterials of a grid city")
+    fleet = parser.add_mutually_exclusive_group()
+    fleet.add_argument("--cars", type=int, help="number of random cars")
+    fleet.add_argument("--cars-file", help="car file with lines x,y")
+    parser.add_argument("--seed", type=int, help="seed of the random map and cars")
+    parser.add_argument("--simulate", type=float, default=0.0, help="simulated time to run the traffic for")
+    parser.add_argument("--dt", type=float, default=0.1, help="simulation timestep")
+    parser.add_argument("--speed", type=float, default=30.0, help="speed of the cars")
+    parser.add_argument("--min-gap", type=float, default=0.0, help="minimum distance between cars")
+    parser.add_argument("--snap", action="store_true", help="move off-road cars to the nearest road")
+    parser.add_argument("--snap-distance", type=float, help="only move cars this close to a road")
+    parser.add_argument("--frames", metavar="DIR", help="folder for PNG frames of the map and cars")
+    parser.add_argument("--frame-interval", type=float, default=1.0, help="simulated time between two frames")
+    parser.add_argument("--frame-size", type=_size, default=(1280, 720), help="frame size as WIDTHxHEIGHT")
+    parser.add_argument("--output", help="JSON file for the results, printed when omitted")
+    parser.add_argument("--cars-out", help="file for the car positions at the end of the simulation")
+    args = parser.parse_args(argv)
+
+    result = run_scenario(
+        num_segments=args.segments, map_file=args.map_file, num_cars=args.cars, cars_file=args.cars_file,
+        seed=args.seed, simulate=args.simulate, dt=args.dt, speed=args.speed, min_gap=args.min_gap,
+        snap=args.snap, snap_distance=args.snap_distance, grid=args.grid, block_size=args.block_size,
+        missing_group_rate=args.missing_group_rate, arterial_spacing=args.arterial_spacing,
+        frames=args.frames, frame_interval=args.frame_interval, frame_size=args.frame_size)
+
+    positions = result.pop("positions", None)
+    if args.cars_out and positions is not None:
+        np.savetxt(args.cars_out, positions, delimiter=",", fmt="%.17g")
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+        print(f"{result['status']}: {result.get('segments', 0)} segments, {result.get('cars', 0)} cars "
+              f"in {result['timings']['total']:.3f} s, results saved to {args.output}.")
+    else:
+        print(text)
+    return exit_status(result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+#Benchmarks of the generation, validation and rendering hot paths
+
+"""
+Times the main entry points of the simulator at sizes from 10^2 to 10^6 with fixed
+seeds and writes the results to a JSON file. Two result files can be compared to
+flag regressions before a change is merged.
+
+Usage:
+    python benchmarks.py run [--output results.json] [--max-size 1000000] [--repeat 3] [--only name,...]
+    python benchmarks.py compare old.json new.json [--threshold 1.25]
+    python benchmarks.py import [--module map_core] [--budget 0.5]
+
+Rendering is measured offscreen: the SimWindow frame is built without showing the
+viewport, and the dearpygui draw calls it makes are counted.
+
+The import check times "import map_core" in fresh interpreters and fails when it
+goes over the budget or loads the GUI, so headless workers keep starting fast.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import map_core
+from road_index import segment_array
+
+SIZES = [10**2, 10**3, 10**4, 10**5, 10**6]
+SEED = 830
+IMPORT_BUDGET = 0.5  #seconds allowed for the import of the core module
+GUI_MODULES = ("dearpygui", "SimWindow")
+
+
+def _map(num_segments):
+    """Valid loop map with about num_segments segments (even and at least 4)."""
+    return map_core.generate_random_segments(max(4, num_segments // 2 * 2), seed=SEED)
+
+
+def _cars_map(num_cars):
+    """Map used by the car benchmarks: scales with the cars up to 10^5 segments."""
+    return _map(min(num_cars, 10**5))
+
+
+def bench_generate_segments(n):
+    return lambda: map_core.generate_random_segments(max(4, n // 2 * 2), seed=SEED)
+
+
+def bench_generate_grid(n):
+    return lambda: map_core.generate_grid_city(max(4, n), seed=SEED)
+
+
+def bench_validate_map(n):
+    segments = _map(n)
+    return lambda: map_core.are_segments_connected(segments)
+
+
+def bench_generate_cars(n):
+    segments = _cars_map(n)
+    return lambda: map_core.generate_random_cars(n, segments, seed=SEED)
+
+
+def bench_validate_cars(n):
+    segments = _cars_map(n)
+    cars = map_core.generate_random_cars(n, segments, seed=SEED)
+    return lambda: map_core.validate_car_positions(cars, segments)
+
+
+def _grid_points(n, near):
+    """Grid city of about n segments and n points: near its roads, or scattered around it."""
+    segments = map_core.generate_grid_city(max(4, n), seed=SEED)
+    coords = segment_array(segments)
+    rng = np.random.default_rng(SEED)
+    if near:
+        road = rng.integers(len(coords), size=n)
+        along = rng.random((n, 1))
+        points = coords[road, :2] + (coords[road, 2:] - coords[road, :2]) * along + rng.normal(0, 3, (n, 2))
+    else:
+        low, high = coords.reshape(-1, 2).min(axis=0), coords.reshape(-1, 2).max(axis=0)
+        points = rng.uniform(2 * low - high, 2 * high - low, (n, 2))
+    return segments, points
+
+
+def bench_snap_cars(n):
+    """Cars slightly off the roads of a grid city, the usual input of snap_cars_to_roads."""
+    segments, cars = _grid_points(n, near=True)
+    return lambda: map_core.snap_cars_to_roads(cars, segments)
+
+
+def bench_nearest_far(n):
+    """Points scattered over three times the extent of a grid city, most of them outside it."""
+    segments, points = _grid_points(n, near=False)
+    return lambda: map_core.diagnose_car_positions(points, segments)
+
+
+def bench_render_first_frame(n):
+    """First frame of a new window: tiles, roads and cars are all built."""
+    segments = _map(n)
+    cars = map_core.generate_random_cars(n, segments, seed=SEED)
+
+    def run():
+        window = _window(segments, cars)
+        try:
+            window._render_loop(None)
+        finally:
+            _close_window()
+    return run
+
+
+def bench_render_frame(n):
+    """Steady frame with every car moved: only the cars are redrawn."""
+    segments = _map(n)
+    cars = np.array(map_core.generate_random_cars(n, segments, seed=SEED))
+    window = _window(segments, cars)
+    window._render_loop(None)
+
+    def run():
+        cars[:, 0] += 0.25  #moves every car, the frame cannot reuse the previous one
+        window._render_loop(None)
+    run.close = _close_window
+    return run
+
+
+def bench_render_offscreen(n):
+    """Offscreen frame of the whole map with every car moved, no display needed."""
+    from offscreen import OffscreenRenderer
+    segments = _map(n)
+    cars = np.array(map_core.generate_random_cars(n, segments, seed=SEED))
+    renderer = OffscreenRenderer(segments, cars)
+    renderer.fit()
+    renderer.render()
+
+    def run():
+        cars[:, 0] += 0.25
+        renderer.render()
+    return run
+
+
+BENCHMARKS = {
+    "generate_random_segments": bench_generate_segments,
+    "generate_grid_city": bench_generate_grid,
+    "are_segments_connected": bench_validate_map,
+    "generate_random_cars": bench_generate_cars,
+    "validate_car_positions": bench_validate_cars,
+    "snap_cars_to_roads": bench_snap_cars,
+    "nearest_far_points": bench_nearest_far,
+    "render_first_frame": bench_render_first_frame,
+    "render_frame": bench_render_frame,
+    "render_offscreen": bench_render_offscreen,
+}
+
+RENDER_BENCHMARKS = {"render_first_frame", "render_frame"}
+
+
+def _window(segments, cars):
+    """Offscreen window with the whole map in view, the worst case for culling."""
+    from SimWindow import SimWindow
+    window = SimWindow(segments, cars)
+    points = np.asarray(segments, dtype=float).reshape(-1, 2)
+    low, high = points.min(axis=0), points.max(axis=0)
+    span = np.maximum(high - low, 1.0)
+    window.zoom = 0.9 * min(window._canvas_width / float(span[0]), window._canvas_height / float(span[1]))
+    window.offset = tuple((-(low + high) / 2).tolist())
+    return window
+
+
+def _close_window():
+    import dearpygui.dearpygui as dpg
+    dpg.destroy_context()
+
+
+@contextlib.contextmanager
+def _count_draw_calls():
+    """Counts the calls to the dearpygui draw_* functions made inside the block."""
+    import dearpygui.dearpygui as dpg
+    counts = {"calls": 0}
+    originals = {name: getattr(dpg, name) for name in dir(dpg) if name.startswith("draw_")}
+
+    def counting(function):
+        def wrapper(*args, **kwargs):
+            counts["calls"] += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    for name, function in originals.items():
+        setattr(dpg, name, counting(function))
+    try:
+        yield counts
+    finally:
+        for name, function in originals.items():
+            setattr(dpg, name, function)
+
+
+def measure(name, size, repeat=3):
+    """
+    Times one benchmark at one size.
+
+    Parameters:
+        name (str): Name of the benchmark (a key of BENCHMARKS).
+        size (int): Problem size.
+        repeat (int): Number of timed runs.
+
+    Returns:
+        dict: Result with the best and median time in seconds (and the draw calls of
+        one run for the rendering benchmarks).
+    """
+    render = name in RENDER_BENCHMARKS
+    with contextlib.redirect_stdout(io.StringIO()):  #validation messages are not part of the result
+        run = BENCHMARKS[name](size)
+        times = []
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+            if render:
+                with _count_draw_calls() as counts:
+                    run()
+        finally:
+            if hasattr(run, "close"):
+                run.close()
+    result = {"name": name, "size": size, "seconds": min(times), "median": statistics.median(times)}
+    if render:
+        result["draw_calls"] = counts["calls"]
+    return result
+
+
+def run_benchmarks(names, sizes, repeat=3, report=True):
+    """
+    Runs the given benchmarks at every size.
+
+    Returns:
+        dict: The results with information about the machine, ready to be saved as JSON.
+    """
+    results = []
+    for name in names:
+        if name in RENDER_BENCHMARKS and not _has_dearpygui():
+            if report:
+                print(f"{name:<28} skipped (dearpygui is not installed)")
+            continue
+        for size in sizes:
+            result = measure(name, size, repeat)
+            results.append(result)
+            if report:
+                calls = f"  {result['draw_calls']:>8} draw calls" if "draw_calls" in result else ""
+                print(f"{name:<28} {size:>9}  {result['seconds'] * 1000:>10.2f} ms{calls}")
+    return {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": SEED,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def _has_dearpygui():
+    try:
+        import dearpygui.dearpygui  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def compare(old, new, threshold=1.25, min_seconds=1e-3):
+    """
+    Compares two benchmark runs.
+
+    A result is a regression when it is more than threshold times slower than before
+    (and slower by at least min_seconds, to ignore timer noise on tiny cases), or when
+    a rendering benchmark makes more draw calls than before.
+
+    Parameters:
+        old (dict): Results of the reference run.
+        new (dict): Results of the run to check.
+        threshold (float): Allowed slowdown ratio.
+        min_seconds (float): Smallest slowdown in seconds that counts.
+
+    Returns:
+        list of dicts: One row per benchmark and size found in both runs, with the
+        old and new times, their ratio and a "regression" flag.
+    """
+    before = {(r["name"], r["size"]): r for r in old["results"]}
+    rows = []
+    for result in new["results"]:
+        reference = before.get((result["name"], result["size"]))
+        if reference is None:
+            continue
+        ratio = result["seconds"] / reference["seconds"] if reference["seconds"] > 0 else float("inf")
+        slower = ratio > threshold and result["seconds"] - reference["seconds"] > min_seconds
+        more_calls = result.get("draw_calls", 0) > reference.get("draw_calls", 0)
+        rows.append({
+            "name": result["name"],
+            "size": result["size"],
+            "old": reference["seconds"],
+            "new": result["seconds"],
+            "ratio": ratio,
+            "regression": slower or more_calls,
+        })
+    return rows
+
+
+def measure_import(module="map_core", repeat=5):
+    """
+    Times the import of a module in fresh interpreters, without their start-up time.
+
+    Parameters:
+        module (str): Name of the module to import.
+        repeat (int): Number of interpreters started.
+
+    Returns:
+        dict: Best and median import time in seconds, and the GUI modules the import loaded.
+    """
+    code = (f"import sys, time\nstart = time.perf_counter()\nimport {module}\n"
+            f"print(time.perf_counter() - start)\n"
+            f"print(','.join(m for m in sys.modules if m.split('.')[0] in {GUI_MODULES!r}))")
+    times, gui = [], set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        times.append(float(output[0]))
+        if len(output) > 1:
+            gui.update(name for name in output[1].split(",") if name)
+    return {"module": module, "seconds": min(times), "median": statistics.median(times), "gui_modules": sorted(gui)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulator hot paths.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmarks and save the results")
+    run.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    run.add_argument("--max-size", type=int, default=SIZES[-1], help="largest size to run")
+    run.add_argument("--repeat", type=int, default=3, help="timed runs per case")
+    run.add_argument("--only", default="", help="comma-separated benchmark names")
+    check = commands.add_parser("compare", help="flag regressions between two result files")
+    check.add_argument("old", help="reference results")
+    check.add_argument("new", help="results to check")
+    check.add_argument("--threshold", type=float, default=1.25, help="allowed slowdown ratio")
+    imports = commands.add_parser("import", help="check that the core module imports fast and without the GUI")
+    imports.add_argument("--module", default="map_core", help="module to import")
+    imports.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="allowed import time in seconds")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        result = measure_import(args.module)
+        print(f"import {result['module']}: {result['seconds'] * 1000:.1f} ms "
+              f"(median {result['median'] * 1000:.1f} ms, budget {args.budget * 1000:.0f} ms)")
+        if result["gui_modules"]:
+            print(f"FAIL: the import loaded {', '.join(result['gui_modules'])}.")
+            return 1
+        if result["seconds"] > args.budget:
+            print("FAIL: the import is over budget.")
+            return 1
+        return 0
+
+    if args.command == "run":
+        names = [name for name in args.only.split(",") if name] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            parser.error(f"unknown benchmark {unknown[0]}, choose from {', '.join(BENCHMARKS)}")
+        sizes = [size for size in SIZES if size <= args.max_size]
+        results = run_benchmarks(names, sizes, args.repeat)
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults saved to {args.output}.")
+        return 0
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    rows = compare(old, new, args.threshold)
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['name']:<28} {row['size']:>9}  {row['old'] * 1000:>10.2f} ms -> "
+              f"{row['new'] * 1000:>10.2f} ms  x{row['ratio']:.2f}{flag}")
+    regressions = sum(row["regression"] for row in rows)
+    print(f"\n{regressions} regression(s) in {len(rows)} comparable results.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#Connectivity of road segments through their junctions
+
+import numpy as np
+
+from road_graph import RoadGraph
+
+
+class UnionFind:
+    """
+    Disjoint sets over the integers 0..n-1 with union by size and path halving.
+    """
+
+    def __init__(self, n=0):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self):
+        """Adds a new singleton set and returns its element."""
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, i):
+        """Returns the representative of the set containing i."""
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """
+        Merges the sets of i and j.
+
+        Returns:
+            bool: True if two different sets were merged, False if already joined.
+        """
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return False
+        if self.size[root_i] < self.size[root_j]:
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        self.size[root_i] += self.size[root_j]
+        return True
+
+
+class Connectivity:
+    """
+    Connectivity engine for a road map, working on its compiled RoadGraph.
+
+    Reachability is a traversal of the CSR edges and connected components come from
+    union-find over the graph nodes, both linear in the size of the map.
+    """
+
+    def __init__(self, segments):
+        """
+        Parameters:
+            segments (list of tuples, array or RoadGraph): The road map, each segment
+            is ((x1, y1), (x2, y2)). A RoadGraph is used as is.
+        """
+        self.graph = segments if isinstance(segments, RoadGraph) else RoadGraph(segments)
+
+    def __len__(self):
+        return self.graph.num_segments
+
+    def reachable(self, start=0):
+        """
+        Finds the segments that can be reached from a segment by driving along the
+        roads, turning at junctions (including T-junctions).
+
+        The drive starts along the start segment, so a segment is reached when it
+        starts at the end of that segment, at a T-junction on it, or further on. A
+        segment sharing only the start point of the start segment is not reached
+        unless the roads lead back there.
+
+        Parameters:
+            start (int): Index of the segment to start from.
+
+        Returns:
+            numpy.ndarray: Boolean mask, True for every reachable segment.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=bool)
+        graph = self.graph
+        edges = graph.edges_of_segment(start)
+        #A single point segment has no edges, the drive starts at its end like any other
+        first = graph.targets[edges] if len(edges) else graph.segment_end_node[start]
+        reached = graph.reachable_nodes(first)[graph.segment_start_node]
+        reached[start] = True
+        return reached
+
+    def union_find(self):
+        """
+        Joins the nodes linked by an edge, regardless of its direction.
+
+        Returns:
+            UnionFind: Disjoint sets over the graph nodes.
+        """
+        sets = UnionFind(self.graph.num_nodes)
+        for source, target in zip(self.graph.sources.tolist(), self.graph.targets.tolist()):
+            sets.union(source, target)
+        return sets
+
+    def components(self):
+        """
+        Splits the segments into connected components.
+
+        Returns:
+            list of lists: Member segment indices of each component, largest first.
+            The size of a component is the length of its list.
+        """
+        sets = self.union_find()
+        members = {}
+        for i, node in enumerate(self.graph.segment_start_node.tolist()):
+            members.setdefault(sets.find(node), []).append(i)
+        return sorted(members.values(), key=len, reverse=True)
@@ -0,0 +1,129 @@
+#Per-frame timings and item counts of the viewer, with export for offline analysis
+
+import contextlib
+import csv
+import json
+import time
+from collections import deque
+
+#Shared do-nothing timer, used when profiling is off so a phase costs one call
+UNTIMED = contextlib.nullcontext()
+
+
+class FrameProfiler:
+    """
+    Records how long each phase of a frame takes and how many items were drawn.
+
+    A frame is opened with start_frame, its phases are timed with
+    "with profiler.phase(name):" (phases do not nest) and it is closed with end_frame.
+    The last frames are kept in a ring buffer (history), so profiling can stay on for
+    a long session.
+    """
+
+    def __init__(self, history=600):
+        """
+        Parameters:
+            history (int): Number of frames kept for the averages and the export.
+        """
+        self.frames = deque(maxlen=history)
+        self.frame_count = 0
+        self._current = None
+        self._phase = _PhaseTimer(self)
+
+    def start_frame(self):
+        """Opens a new frame."""
+        self._current = {"frame": self.frame_count, "start": time.perf_counter(), "phases": {}, "items": {}}
+
+    def phase(self, name):
+        """Context manager timing one phase of the current frame (phases of the same name add up)."""
+        self._phase.name = name
+        return self._phase
+
+    def count(self, name, value):
+        """Records the number of items of one kind drawn in the current frame."""
+        if self._current is not None:
+            self._current["items"][name] = value
+
+    def end_frame(self):
+        """Closes the current frame and adds it to the history."""
+        if self._current is None:
+            return
+        self._current["total"] = time.perf_counter() - self._current["start"]
+        self.frames.append(self._current)
+        self.frame_count += 1
+        self._current = None
+
+    def fps(self, window=1.0):
+        """Frames per second over the last window seconds."""
+        if len(self.frames) < 2:
+            return 0.0
+        last = self.frames[-1]["start"]
+        recent = [frame for frame in self.frames if last - frame["start"] <= window]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / (last - recent[0]["start"])
+
+    def averages(self, last=60):
+        """
+        Average time of each phase over the last frames.
+
+        Returns:
+            dict: Average seconds per phase name, plus "total" for the whole frame.
+        """
+        frames = list(self.frames)[-last:]
+        if not frames:
+            return {}
+        totals = {}
+        for frame in frames:
+            for name, seconds in frame["phases"].items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        averages = {name: seconds / len(frames) for name, seconds in totals.items()}
+        averages["total"] = sum(frame["total"] for frame in frames) / len(frames)
+        return averages
+
+    def export(self, file_path):
+        """
+        Writes the recorded frames to a file, as CSV if the name ends with ".csv"
+        (one row per frame, one column per phase and item kind) and as JSON otherwise.
+
+        Returns:
+            int: Number of frames written.
+        """
+        frames = list(self.frames)
+        if file_path.lower().endswith(".csv"):
+            phases = sorted({name for frame in frames for name in frame["phases"]})
+            items = sorted({name for frame in frames for name in frame["items"]})
+            with open(file_path, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["frame", "start", "total"] + [f"{name}_s" for name in phases]
+                                + [f"{name}_items" for name in items])
+                for frame in frames:
+                    writer.writerow([frame["frame"], frame["start"], frame["total"]]
+                                    + [frame["phases"].get(name, 0.0) for name in phases]
+                                    + [frame["items"].get(name, "") for name in items])
+        else:
+            with open(file_path, "w") as file:
+                json.dump({"frames": frames}, file, indent=1)
+        return len(frames)
+
+
+class _PhaseTimer:
+    """Reusable context manager adding the time spent in its block to the current frame."""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.name = None
+        self._start = 0.0
+        self._name = None
+
+    def __enter__(self):
+        self._name = self.name
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        current = self.profiler._current
+        if current is not None:
+            phases = current["phases"]
+            phases[self._name] = phases.get(self._name, 0.0) + time.perf_counter() - self._start
+        return False
@@ -0,0 +1,233 @@
+#Random generation of road maps: random-walk loops and grid cities
+
+import random
+from array import array
+
+import numpy as np
+
+from road_index import IntervalOccupancy, segment_array
+from road_map import HORIZONTAL, VERTICAL, RoadMap
+
+
+def generate_loop_segments(num_segments, seed=None, min_distance=10, max_attempts=1000):
+    """
+    Generates a closed loop of alternating horizontal and vertical road segments.
+
+    The loop is a random walk: horizontal steps go left or right, vertical steps go up,
+    and every step is 10 to 100 units long. Collinear segments on the same row or column
+    must stay more than min_distance apart, which is checked against per-row and
+    per-column interval occupancy instead of every segment placed so far.
+
+    The walk never lands on the starting column and always ends with a vertical step,
+    so the two closing segments (along the top row, then down the starting column) are
+    always valid and the closing phase takes exactly two steps.
+
+    Parameters:
+        num_segments (int): Number of segments, an even number of at least 4.
+        seed (int): Seed for the random number generator, None for a random seed.
+        min_distance (int): Minimum gap between collinear segments.
+        max_attempts (int): Maximum number of rejected candidates for a single step.
+
+    The coordinates are appended to a flat array of doubles and handed to the RoadMap
+    without a copy, so no Python tuple is kept per segment.
+
+    Returns:
+        RoadMap: Segments ((x1, y1), (x2, y2)) forming a closed loop.
+    """
+    if num_segments < 4 or num_segments % 2 != 0:
+        raise ValueError("\nNumber of segments must be an even number of at least 4 to form a closed loop.")
+
+    rng = random.Random(seed)
+    uniform = rng.random  #randint/choice are several times slower than scaling random()
+    rows = IntervalOccupancy()     #horizontal segments, keyed by y
+    columns = IntervalOccupancy()  #vertical segments, keyed by x
+
+    start_x, start_y = rng.randint(0, 500), rng.randint(0, 500)
+    x1, y1 = start_x, start_y
+    coords = array("d")
+    extend = coords.extend
+
+    #Walk num_segments - 2 segments, horizontal first, the 2 last segments close the road
+    for step in range(num_segments - 2):
+        for _ in range(max_attempts):
+            if step % 2 == 0:  #Horizontal segment
+                length = 10 + int(uniform() * 91)
+                x2, y2 = (x1 + length if uniform() < 0.5 else x1 - length), y1
+                lo, hi = min(x1, x2), max(x1, x2)
+                #Keep the starting column free for closing and leave room for the next vertical step
+                if x2 != start_x and not rows.conflicts(y1, lo, hi, min_distance) \
+                        and not columns.conflicts(x2, y1, y1, min_distance):
+                    rows.add(y1, lo, hi)
+                    break
+            else:  #Vertical segment
+                x2, y2 = x1, y1 + 10 + int(uniform() * 91)
+                if not columns.conflicts(x1, y1, y2, min_distance):
+                    columns.add(x1, y1, y2)
+                    break
+        else:
+            raise RuntimeError(f"\nCould not place segment {step + 1} after {max_attempts} attempts.")
+
+        extend((x1, y1, x2, y2))
+        x1, y1 = x2, y2
+
+    #Close the road: the top row and the starting column are free by construction
+    extend((x1, y1, start_x, y1))
+    extend((start_x, y1, start_x, start_y))
+    return RoadMap(np.frombuffer(coords, dtype=np.float64))
+
+
+def generate_car_positions(segments, num_cars, seed=None):
+    """
+    Generates random car positions on the road segments in one vectorized pass.
+
+    Segments are picked in proportion to their length, so cars are spread evenly
+    along the roads instead of crowding short segments. The cars come out grouped by
+    segment, in segment order (see sample_along).
+
+    Parameters:
+        segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+        num_cars (int): Number of cars to generate.
+        seed (int): Seed for the random number generator, None for a random seed.
+
+    Returns:
+        numpy.ndarray: Array of shape (num_cars, 2) with the (x, y) position of each car.
+    """
+    segs = segment_array(segments)
+    if len(segs) == 0:
+        raise ValueError("\nCars can only be placed on a map with at least one segment.")
+    x1, y1, x2, y2 = segs.T
+    if np.any((x1 != x2) & (y1 != y2)):
+        raise ValueError("\nSegments must be strictly horizontal or vertical.")
+
+    rng = np.random.default_rng(seed)
+    lengths = np.abs(x2 - x1) + np.abs(y2 - y1)
+    if lengths.sum() == 0:  #only single points, all equally likely
+        return segs[rng.integers(len(segs), size=num_cars), :2].copy()
+    index, offset = sample_along(lengths, num_cars, rng)
+
+    #Unit direction of each segment (zero-length segments are never picked here).
+    #The segment values are gathered one coordinate at a time and combined in place,
+    #as the temporaries of the size of num_cars cost more than the arithmetic.
+    safe_lengths = np.where(lengths > 0, lengths, 1)
+    positions = np.empty((num_cars, 2))
+    for column, (p1, p2) in enumerate(((x1, x2), (y1, y2))):
+        values = ((p2 - p1) / safe_lengths).take(index)
+        values *= offset
+        values += p1.take(index)
+        positions[:, column] = values
+    return positions
+
+
+def sample_along(lengths, num_samples, rng):
+    """
+    Draws points uniformly along a set of roads (segments or graph edges).
+
+    The number of points on each road is drawn at once from a multinomial distribution
+    weighted by the road lengths, then each point gets a uniform distance from the start
+    of its road. This gives the same distribution as drawing every point along the total
+    length, but the points come out grouped by road, in road order, so all the per-road
+    lookups read memory sequentially. Roads of zero length are never picked.
+
+    Parameters:
+        lengths (numpy.ndarray): Length of each road, with a positive total.
+        num_samples (int): Number of points to draw.
+        rng (numpy.random.Generator): Random number generator.
+
+    Returns:
+        tuple: (index, offset) arrays, the road of each point and its distance from
+        the start of the road.
+    """
+    counts = rng.multinomial(num_samples, lengths / lengths.sum())
+    index = np.repeat(np.arange(len(lengths)), counts)
+    offset = rng.random(num_samples)
+    offset *= lengths.take(index)
+    return index, offset
+
+
+def generate_grid_segments(blocks_x, blocks_y, block_size=100, missing_group_rate=0.0, arterial_spacing=10, seed=None):
+    """
+    Generates a Manhattan-style grid of one-way streets in a few vectorized passes.
+
+    Every side of a block is one segment between two intersections, so collinear
+    segments only touch at their endpoints. The streets alternate direction from one
+    row (or column) to the next, and the outer ring runs counterclockwise, so every
+    street can be reached from every other one.
+
+    Missing blocks come in groups of 3 x 3 blocks, one possible group every 4 x 4
+    blocks, whose inner streets are removed. The perimeter of such a group is a loop
+    running one way, like a single block, so the map stays connected without being
+    checked. Groups crossing an arterial (every arterial_spacing-th row and column,
+    which are never broken) are left whole.
+
+    Parameters:
+        blocks_x (int): Number of blocks along x.
+        blocks_y (int): Number of blocks along y.
+        block_size (float or tuple): Width of a block, or its (width, height).
+        missing_group_rate (float): Share of the possible 3 x 3 groups that are missing, from 0 to 1.
+        arterial_spacing (int): Blocks between two arterials, 0 for no arterials.
+        seed (int): Seed for the random number generator, None for a random seed.
+
+    Returns:
+        RoadMap: The horizontal streets row by row, then the vertical streets.
+    """
+    if blocks_x < 1 or blocks_y < 1:
+        raise ValueError("\nA grid needs at least one block along x and along y.")
+    if not 0 <= missing_group_rate <= 1:
+        raise ValueError("\nThe missing group rate must be between 0 and 1.")
+    width, height = np.broadcast_to(np.asarray(block_size, dtype=np.float64), (2,))
+    xs = np.arange(blocks_x + 1) * width
+    ys = np.arange(blocks_y + 1) * height
+
+    #Even rows run east and odd columns run north, so the blocks (c, r) with c and r of
+    #the same parity are one-way loops; the outer ring runs counterclockwise
+    east = np.arange(blocks_y + 1) % 2 == 0
+    east[[0, -1]] = True, False
+    north = np.arange(blocks_x + 1) % 2 == 1
+    north[[0, -1]] = False, True
+
+    #Horizontal street (c, r) runs along row r from x c to c + 1,
+    #vertical street (c, r) runs along column c from y r to r + 1
+    keep_horizontal = keep_vertical = None
+    if missing_group_rate > 0:
+        #Groups start at the loop blocks (4i + 1, 4j + 1) and stay off the outer ring
+        cs = np.arange(1, blocks_x - 3, 4)
+        rs = np.arange(1, blocks_y - 3, 4)
+        if arterial_spacing > 0:
+            cs = cs[((cs + 1) % arterial_spacing != 0) & ((cs + 2) % arterial_spacing != 0)]
+            rs = rs[((rs + 1) % arterial_spacing != 0) & ((rs + 2) % arterial_spacing != 0)]
+        rng = np.random.default_rng(seed)
+        missing = rng.random((len(rs), len(cs))) < missing_group_rate
+        group_rows, group_columns = rs[np.nonzero(missing)[0]], cs[np.nonzero(missing)[1]]
+
+        keep_horizontal = np.ones((blocks_y + 1, blocks_x), dtype=bool)
+        keep_vertical = np.ones((blocks_y, blocks_x + 1), dtype=bool)
+        for inner in (1, 2):
+            for along in range(3):
+                keep_horizontal[group_rows + inner, group_columns + along] = False
+                keep_vertical[group_rows + along, group_columns + inner] = False
+
+    horizontal_shape, vertical_shape = (blocks_y + 1, blocks_x), (blocks_y, blocks_x + 1)
+    num_horizontal = np.prod(horizontal_shape) if keep_horizontal is None else int(keep_horizontal.sum())
+    num_vertical = np.prod(vertical_shape) if keep_vertical is None else int(keep_vertical.sum())
+    coords = np.empty((num_horizontal + num_vertical, 4))
+    west_end, east_end = xs[:-1], xs[1:]
+    east = east[:, None]
+    _fill_streets(coords[:num_horizontal], keep_horizontal, horizontal_shape,
+                  np.where(east, west_end, east_end), ys[:, None], np.where(east, east_end, west_end), ys[:, None])
+    south_end, north_end = ys[:-1, None], ys[1:, None]
+    _fill_streets(coords[num_horizontal:], keep_vertical, vertical_shape,
+                  xs, np.where(north, south_end, north_end), xs, np.where(north, north_end, south_end))
+
+    orientation = np.empty(len(coords), dtype=np.int8)
+    orientation[:num_horizontal] = HORIZONTAL
+    orientation[num_horizontal:] = VERTICAL
+    return RoadMap(coords, orientation)
+
+
+def _fill_streets(out, keep, shape, *columns):
+    #Writes the x1, y1, x2, y2 columns (broadcast to the grid shape) of the kept streets
+    for k, column in enumerate(columns):
+        if keep is None:
+            out.reshape(shape + (4,))[..., k] = column
+        else:
+            out[:, k] = np.broadcast_to(column, shape)[keep]
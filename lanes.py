@@ -0,0 +1,232 @@
+#Cars kept sorted along each lane (graph edge or segment) for headway and collision queries
+
+import numpy as np
+
+from road_index import grouped_bisect
+
+
+class LaneOccupancy:
+    """
+    Occupancy of the lanes, with the cars sorted by (lane, offset).
+
+    A lane is anything cars drive along from a start offset, usually the edges of the
+    RoadGraph or the road segments. The sorted cars of lane L are the slice
+    lane_offsets[L]:lane_offsets[L + 1] of the sorted arrays (CSR form), so the car
+    ahead or behind is the next or previous entry and any position can be looked up by
+    a binary search inside its lane. All queries take arrays and run for every car at once.
+    """
+
+    def __init__(self, lanes, offsets, num_lanes=None):
+        """
+        Parameters:
+            lanes (array): Lane of each car.
+            offsets (array): Distance of each car from the start of its lane.
+            num_lanes (int): Number of lanes, one more than the largest lane by default.
+        """
+        self.num_lanes = num_lanes
+        self.order = self.lane = np.zeros(0, dtype=np.int64)
+        self.update(lanes, offsets)
+
+    def __len__(self):
+        return len(self.order)
+
+    def update(self, lanes, offsets):
+        """
+        Re-sorts the cars after they moved, typically once after every simulation step.
+
+        The previous order is the starting point: cars rarely overtake or change lane
+        within one step, so only the few cars that broke the order are taken out, sorted
+        and merged back in with binary searches. A full sort is only used when many cars
+        moved out of place.
+        """
+        lanes = np.asarray(lanes, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=float)
+        if self.num_lanes is None:
+            self.num_lanes = int(lanes.max()) + 1 if len(lanes) else 0
+        if len(self.order) == len(lanes) and len(lanes):
+            order = _repair_order(self.order, self.lane, lanes, offsets)
+        else:
+            order = np.lexsort((offsets, lanes))
+        self.order = order
+        self.lane = lane = lanes[order]
+        self.offset = offsets[order]
+        self.rank = np.empty(len(order), dtype=np.int64)
+        self.rank[order] = np.arange(len(order))
+        self.lane_offsets = np.zeros(self.num_lanes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lane, minlength=self.num_lanes), out=self.lane_offsets[1:])
+
+    def leader(self, cars=None):
+        """
+        Finds the car directly ahead of each car in the same lane.
+
+        Parameters:
+            cars (array): Car ids, all cars by default.
+
+        Returns:
+            numpy.ndarray: Id of the car ahead, -1 for the first car of a lane.
+        """
+        return self._neighbour(cars, 1)
+
+    def follower(self, cars=None):
+        """
+        Finds the car directly behind each car in the same lane.
+
+        Returns:
+            numpy.ndarray: Id of the car behind, -1 for the last car of a lane.
+        """
+        return self._neighbour(cars, -1)
+
+    def _neighbour(self, cars, step):
+        rank = self.rank if cars is None else self.rank[np.asarray(cars, dtype=np.int64)]
+        other = rank + step
+        inside = (other >= 0) & (other < len(self.order))
+        same = np.zeros(len(rank), dtype=bool)
+        same[inside] = self.lane[other[inside]] == self.lane[rank[inside]]
+        return np.where(same, self.order[np.where(same, other, 0)], -1)
+
+    def headway(self, cars=None):
+        """
+        Distance from each car to the car ahead of it in the same lane.
+
+        Returns:
+            numpy.ndarray: The gaps, inf for the first car of a lane.
+        """
+        rank = self.rank if cars is None else self.rank[np.asarray(cars, dtype=np.int64)]
+        leader = self.leader(cars)
+        ahead = leader >= 0
+        gaps = np.full(len(rank), np.inf)
+        gaps[ahead] = self.offset[self.rank[leader[ahead]]] - self.offset[rank[ahead]]
+        return gaps
+
+    def first_at_or_after(self, lanes, offsets):
+        """
+        Finds the first car at or after the given positions, e.g. the car a car entering
+        a lane would follow. One binary search inside the lane per position.
+
+        Parameters:
+            lanes (array): Lane of each position.
+            offsets (array): Distance of each position from the start of its lane.
+
+        Returns:
+            numpy.ndarray: Id of the car, -1 if there is no car further along the lane.
+        """
+        lanes = np.asarray(lanes, dtype=np.int64)
+        ends = self.lane_offsets[lanes + 1]
+        rank = grouped_bisect(self.offset, self.lane_offsets[lanes], ends,
+                              np.asarray(offsets, dtype=float), side="left")
+        found = rank < ends
+        return np.where(found, self.order[np.where(found, rank, 0)], -1)
+
+    def count_between(self, lanes, lo, hi):
+        """
+        Counts the cars with lo <= offset <= hi in each given lane.
+
+        Returns:
+            numpy.ndarray: Number of cars in each range.
+        """
+        lanes = np.asarray(lanes, dtype=np.int64)
+        starts, ends = self.lane_offsets[lanes], self.lane_offsets[lanes + 1]
+        first = grouped_bisect(self.offset, starts, ends, np.asarray(lo, dtype=float), side="left")
+        last = grouped_bisect(self.offset, starts, ends, np.asarray(hi, dtype=float), side="right")
+        return np.maximum(last - first, 0)
+
+    def cars_between(self, lane, lo, hi):
+        """Returns the ids of the cars with lo <= offset <= hi in one lane, in driving order."""
+        start, end = self.lane_offsets[lane], self.lane_offsets[lane + 1]
+        first = start + np.searchsorted(self.offset[start:end], lo, side="left")
+        last = start + np.searchsorted(self.offset[start:end], hi, side="right")
+        return self.order[first:last]
+
+    def collisions(self, min_gap=0.0):
+        """
+        Finds the cars that are closer than min_gap to the car ahead in the same lane
+        (or at the same position when min_gap is 0). Only consecutive cars are compared,
+        so k cars at one point give k - 1 pairs.
+
+        Returns:
+            numpy.ndarray: Array of shape (n, 2) with the (follower, leader) car ids.
+        """
+        same_lane = self.lane[1:] == self.lane[:-1]
+        gaps = self.offset[1:] - self.offset[:-1]
+        close = same_lane & ((gaps < min_gap) if min_gap > 0 else (gaps <= 0))
+        rank = np.flatnonzero(close)
+        return np.column_stack((self.order[rank], self.order[rank + 1]))
+
+    def keep_gap(self, min_gap, offsets=None):
+        """
+        Spacing rule: moves every car back so that it stays at least min_gap behind the
+        car ahead in its lane, the first car of each lane keeps its place. A queue longer
+        than its lane is squeezed together at the start of the lane (offsets never go below 0).
+
+        Parameters:
+            min_gap (float): Minimum distance between consecutive cars.
+            offsets (array): Offsets to correct, in car order, the stored ones by default.
+
+        Returns:
+            numpy.ndarray: The corrected offset of each car, in car order.
+        """
+        offset = self.offset if offsets is None else np.asarray(offsets, dtype=float)[self.order]
+        if len(offset) == 0:
+            return offset.copy()
+        #Shifting the k-th car of a lane back by k * min_gap turns the rule into a running
+        #minimum from the front of the lane, computed for all lanes at once by doubling
+        #the reach of the minimum in each pass (log2 of the longest queue passes).
+        k = np.arange(len(offset)) - self.lane_offsets[self.lane]
+        allowed = offset - k * min_gap
+        remaining = self.lane_offsets[self.lane + 1] - np.arange(len(offset)) - 1  #cars ahead in the lane
+        reach = 1
+        while reach <= remaining.max():
+            reached = np.minimum(allowed[:-reach], allowed[reach:])
+            allowed[:-reach] = np.where(remaining[:-reach] >= reach, reached, allowed[:-reach])
+            reach *= 2
+        allowed += k * min_gap
+        result = np.empty(len(offset))
+        result[self.order] = np.maximum(np.minimum(offset, allowed), 0.0)
+        return result
+
+
+def _descents(lane, offset):
+    """Marks the consecutive pairs that are not sorted by (lane, offset)."""
+    step = np.diff(lane)
+    return (step < 0) | ((step == 0) & (offset[1:] < offset[:-1]))
+
+
+def _repair_order(order, previous_lanes, lanes, offsets, max_rounds=4, max_moved=0.25):
+    """
+    Sorts the cars by (lane, offset) starting from the previous sorted order: the cars
+    that changed lane are removed, then both cars of every pair still out of order until
+    the rest is sorted. The removed cars are sorted on their own and inserted back at
+    their binary search position.
+    """
+    n = len(order)
+    keep = lanes[order] == previous_lanes
+    if n - keep.sum() > max_moved * n:
+        return np.lexsort((offsets, lanes))
+    for _ in range(max_rounds):
+        kept = np.flatnonzero(keep)
+        descents = _descents(lanes[order[kept]], offsets[order[kept]])
+        if not descents.any():
+            break
+        bad = np.zeros(len(kept), dtype=bool)
+        bad[:-1] |= descents
+        bad[1:] |= descents
+        keep[kept[bad]] = False
+        if n - len(kept) + bad.sum() > max_moved * n:
+            return np.lexsort((offsets, lanes))
+    else:
+        return np.lexsort((offsets, lanes))
+    if keep.all():
+        return order
+
+    kept, moved = order[keep], order[~keep]
+    moved = moved[np.lexsort((offsets[moved], lanes[moved]))]
+    kept_lanes, kept_offsets = lanes[kept], offsets[kept]
+    starts = np.searchsorted(kept_lanes, lanes[moved], side="left")
+    ends = np.searchsorted(kept_lanes, lanes[moved], side="right")
+    slots = grouped_bisect(kept_offsets, starts, ends, offsets[moved], side="right")
+    merged = np.empty(n, dtype=np.int64)
+    is_moved = np.zeros(n, dtype=bool)
+    is_moved[slots + np.arange(len(moved))] = True
+    merged[is_moved] = moved
+    merged[~is_moved] = kept
+    return merged
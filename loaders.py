@@ -0,0 +1,106 @@
+#Bulk loading of segment and car files into NumPy arrays
+
+import numpy as np
+
+
+def load_array(file_path, num_columns, chunk_bytes=1 << 24, block_lines=4096, report=True):
+    """
+    Reads a comma-separated file of numbers into a float array, chunk by chunk.
+
+    Empty lines and lines starting with "#" are ignored. Lines that do not hold exactly
+    num_columns numbers are skipped and reported once in aggregate. Each chunk is parsed
+    by NumPy in one call, only the blocks containing an invalid line are parsed line by line.
+
+    Parameters:
+        file_path (str): Path to the file.
+        num_columns (int): Number of values expected on each line.
+        chunk_bytes (int): Approximate size of the chunks read from the file.
+        block_lines (int): Size of the blocks a chunk with invalid lines is split into.
+        report (bool): Print a summary of the skipped lines.
+
+    Returns:
+        tuple: (values, skipped) where values is an array of shape (n, num_columns) and
+        skipped is the list of invalid lines that were skipped.
+    """
+    chunks = []
+    skipped = []
+    with open(file_path, 'r') as file:
+        while True:
+            text = file.read(chunk_bytes) + file.readline()  #always end on a full line
+            if not text:
+                break
+            if text.isspace():
+                continue  #only blank lines, loadtxt would warn that there is no data
+            lines = text.splitlines()
+            values = None
+            if "#" not in text:
+                #Fast path: NumPy parses the whole chunk and skips empty lines itself
+                values = _load_rows(lines, num_columns)
+            if values is None:
+                #Same filtering as the line by line readers: skip empty lines and comments
+                rows = [line for line in lines if (stripped := line.strip()) and stripped[0] != "#"]
+                values = _load_rows(rows, num_columns)
+                if values is None:
+                    #Only the small blocks holding invalid lines are parsed line by line
+                    values = np.concatenate([
+                        _parse_rows(block, num_columns, skipped)
+                        if (parsed := _load_rows(block, num_columns)) is None else parsed
+                        for block in (rows[k:k + block_lines] for k in range(0, len(rows), block_lines))])
+            chunks.append(values)
+
+    if report and skipped:
+        print(f"\nSkipped {len(skipped)} invalid lines (first one: {skipped[0]}).")
+    if not chunks:
+        return np.empty((0, num_columns)), skipped
+    return np.concatenate(chunks), skipped
+
+
+def _load_rows(rows, num_columns):
+    """Parses rows with NumPy in one call, returns None if any row is invalid."""
+    if not rows:
+        return np.empty((0, num_columns))
+    try:
+        values = np.loadtxt(rows, delimiter=",", dtype=float, ndmin=2, comments=None)
+    except ValueError:
+        return None
+    if values.shape[1] != num_columns:
+        return None
+    return values
+
+
+def _parse_rows(rows, num_columns, skipped):
+    """Slow path of load_array: parses rows one by one and collects the invalid ones."""
+    values = []
+    for row in rows:
+        line = row.strip()
+        try:
+            numbers = list(map(float, line.split(',')))
+        except ValueError:
+            numbers = None
+        if numbers is None or len(numbers) != num_columns:
+            skipped.append(line)
+        else:
+            values.append(numbers)
+    return np.array(values, dtype=float).reshape(-1, num_columns)
+
+
+def load_segments(file_path, report=True):
+    """
+    Loads a segment file with lines "x1,y1,x2,y2".
+
+    Returns:
+        numpy.ndarray: Array of shape (n, 2, 2), segment i is ((x1, y1), (x2, y2)).
+    """
+    values, _ = load_array(file_path, 4, report=report)
+    return values.reshape(-1, 2, 2)
+
+
+def load_cars(file_path, report=True):
+    """
+    Loads a car file with lines "x,y".
+
+    Returns:
+        numpy.ndarray: Array of shape (n, 2) with the position of each car.
+    """
+    values, _ = load_array(file_path, 2, report=report)
+    return values
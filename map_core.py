@@ -0,0 +1,244 @@
+#Map model without the interface: generation, file loading and validation of maps and cars
+
+"""
+Core of the simulator that needs neither prompts nor a display. It only imports NumPy
+and the road modules, so headless users (batch runs, sweep workers, benchmarks) start
+fast and do not need dearpygui. The interactive programme is map_sim, which loads the
+viewer only when a map is visualised.
+"""
+
+import math
+
+import numpy as np
+
+from connectivity import Connectivity
+from generators import generate_car_positions, generate_grid_segments, generate_loop_segments
+from lanes import LaneOccupancy
+from loaders import load_cars, load_segments
+from road_index import RoadIndex, first_overlap
+from road_map import DIAGONAL, CarSet, RoadMap
+
+
+def generate_random_segments(num_segments, seed=None):
+    """
+    Generate a list of interconnected road segments forming a closed loop.
+
+    Candidates are checked against per-row and per-column occupancy (see
+    generators.generate_loop_segments), so generation is close to linear in the
+    number of segments and the closing phase always takes two steps.
+
+    Parameters:
+        num_segments (int): Number of segments, an even number of at least 4.
+        seed (int): Optional seed to make the map reproducible.
+
+    Returns:
+        RoadMap: The segments, each one read as ((x1, y1), (x2, y2)).
+    """
+    return generate_loop_segments(num_segments, seed=seed)
+
+
+def generate_grid_city(num_segments, block_size=100, missing_group_rate=0.1, arterial_spacing=10, seed=None):
+    """
+    Generate a square Manhattan-style grid of streets with about num_segments segments.
+
+    The segments are built directly as arrays and are valid and connected by
+    construction (see generators.generate_grid_segments), so maps of tens of millions
+    of segments take seconds. Missing blocks lower the count below num_segments.
+
+    Blocks go missing in groups of 3 x 3, with at most one possible group in each 4 x 4
+    tile of blocks, and groups crossing an arterial are never removed. missing_group_rate
+    is the share of those possible groups that go missing, not a share of the blocks:
+    1.0 removes about a quarter of the streets with the default arterial spacing, and
+    the default 0.1 about 2.4%.
+
+    Parameters:
+        num_segments (int): Number of segments of the full grid, at least 4.
+        block_size (float or tuple): Width of a block, or its (width, height).
+        missing_group_rate (float): Share of the possible 3 x 3 groups that are missing, from 0 to 1.
+        arterial_spacing (int): Blocks between two arterials that are never broken.
+        seed (int): Optional seed to make the map reproducible.
+
+    Returns:
+        RoadMap: The segments, each one read as ((x1, y1), (x2, y2)).
+    """
+    if num_segments < 4:
+        raise ValueError("\nA grid city needs at least 4 segments.")
+    #n x n blocks have 2n(n + 1) street segments
+    blocks = max(1, round((math.sqrt(1 + 2 * num_segments) - 1) / 2))
+    return generate_grid_segments(blocks, blocks, block_size, missing_group_rate, arterial_spacing, seed=seed)
+
+#Map validation: check if segments connected and not overlapping
+
+def are_segments_connected(segments):
+    """
+    Checks whether the given segments are all connected, ensures no diagonal segments exist, 
+    and ensures no segments overlap.
+
+    Parameters:
+        segments (RoadMap or list of tuples): Each segment is ((x1, y1), (x2, y2)).
+
+    Returns:
+        bool: True if all segments are connected, have no diagonal segments, and do not overlap, 
+        False otherwise.
+    """
+    #The checks below all share the coordinate array of the map, no copy is made of a RoadMap
+    segments = RoadMap.from_segments(segments)
+
+    #Validate that no segment is diagonal (both x and y coordinates change)
+    diagonal = np.flatnonzero(segments.orientation == DIAGONAL)
+    if len(diagonal):
+        i = int(diagonal[0])
+        (x1, y1), (x2, y2) = segments[i]
+        print(f"Error: Segment {i+1} is diagonal: (({x1}, {y1}), ({x2}, {y2})).")
+        return False
+
+    #Validate that no segments overlap (sweep over collinear segments, O(n log n))
+    #Only the pairs are counted, a file of many copies of one segment has quadratically many
+    overlap, count = first_overlap(segments)
+    if overlap is not None:
+        i, j = overlap
+        print(f"Error: Segment {i+1} overlaps with segment {j+1}.")
+        if count > 1:
+            print(f"Error: {count} overlapping segment pairs found in total.")
+        return False
+
+    #Follow the roads from the first segment over the compiled road graph (linear time)
+    connectivity = Connectivity(segments)
+    visited = connectivity.reachable(0)
+
+    #If not all segments are visited, return False
+    if not visited.all():
+        print("Error: Not all segments are connected.")
+        components = connectivity.components()
+        if len(components) > 1:
+            sizes = ", ".join(str(len(component)) for component in components[:10])
+            print(f"Error: The map has {len(components)} disconnected parts (largest sizes: {sizes}).")
+        return False
+
+    return True
+
+
+def read_segments_from_file(file_path):
+    """
+    Reads segment data from a file into a RoadMap.
+
+    Parameters:
+        file_path (str): Path to the file containing segment data.
+
+    Returns:
+        RoadMap: The segments, each one read as ((x1, y1), (x2, y2)).
+    """
+    #Bulk NumPy parsing, invalid lines are skipped and reported together
+    return RoadMap(load_segments(file_path))
+
+
+def generate_random_cars(num_cars, segs, seed=None):
+    """
+    Generate random car positions that lay on the road segments.
+
+    Parameters:
+        num_cars (int): Number of cars to generate.
+        segs (RoadMap or list of tuples): Road segments the cars are placed on.
+        seed (int): Optional seed to make the car positions reproducible.
+
+    Returns:
+        CarSet: The car positions, each one read as (x, y).
+    """
+    #Length-weighted, vectorized placement (see generators.generate_car_positions)
+    return CarSet(generate_car_positions(segs, num_cars, seed=seed))
+
+
+def read_segments_from_file_cars(file_path):
+    """Reads car data from a file into a CarSet."""
+    return CarSet(load_cars(file_path))
+
+def validate_car_positions(cars, segments):
+    """
+    Validates that all cars are placed on valid road segments.
+
+    The segments are put in a RoadIndex so all cars are checked in one batched query
+    instead of testing every car against every segment. Cars sharing their position
+    with another car are reported as a warning.
+    """
+    cars = CarSet.from_points(cars)
+    index = RoadIndex(segments)
+    segment_ids = index.locate(cars)
+    off_road = np.flatnonzero(segment_ids < 0)
+    if len(off_road):
+        #Every off-road car is found in the same pass, the first few are shown with their distance
+        _, _, distances = index.nearest(cars.positions[off_road[:5]])
+        for i, distance in zip(off_road[:5].tolist(), distances.tolist()):
+            print(f"\nCar at position {cars[i]} is not on any valid road segment ({distance:.4g} from the nearest road).")
+        if len(off_road) > 5:
+            print(f"\n{len(off_road)} cars in total are not on any valid road segment.")
+        return False
+
+    #Cars sorted along their segment: cars sharing a position are neighbours
+    points = cars.positions
+    offsets = np.abs(points - index.segments[segment_ids, :2]).sum(axis=1)
+    stacked = LaneOccupancy(segment_ids, offsets, len(index.segments)).collisions()
+    if len(stacked):
+        print(f"\nWarning: {len(np.unique(stacked))} cars share their position with another car.")
+    return True
+
+def diagnose_car_positions(cars, segments):
+    """
+    Checks every car against the roads in one batched query.
+
+    Parameters:
+        cars (CarSet or list of tuples): Car positions (x, y).
+        segments (RoadMap or list of tuples): Road segments ((x1, y1), (x2, y2)).
+
+    Returns:
+        dict: Arrays with one entry per car: "on_road" (bool), "segment" (index of the
+        road the car is on, or of the nearest road), "projected" (closest point on that
+        road, shape (n, 2)) and "distance" (from the car to that point).
+    """
+    segment_ids, projected, distances = RoadIndex(segments).nearest(CarSet.from_points(cars).positions)
+    return {"on_road": distances == 0, "segment": segment_ids, "projected": projected, "distance": distances}
+
+
+def snap_cars_to_roads(cars, segments, max_distance=None):
+    """
+    Moves every off-road car to the closest point of the nearest road, in one pass.
+
+    Parameters:
+        cars (CarSet or list of tuples): Car positions (x, y).
+        segments (RoadMap or list of tuples): Road segments ((x1, y1), (x2, y2)).
+        max_distance (float): Cars further than this from every road are left where
+            they are, None to move them all.
+
+    Returns:
+        tuple: (snapped, moved) with the new positions as a CarSet and the number of cars moved.
+    """
+    cars = CarSet.from_points(cars)
+    report = diagnose_car_positions(cars, segments)
+    move = ~report["on_road"] & np.isfinite(report["distance"])
+    if max_distance is not None:
+        move &= report["distance"] <= max_distance
+    positions = cars.positions.copy()
+    positions[move] = report["projected"][move]
+    return CarSet(positions), int(move.sum())
+
+
+def is_point_on_segment(point, segment):
+    """
+    Checks if a point lies on a line segment.
+
+    Parameters:
+        point (list): [x, y] coordinates of the point.
+        segment (list): [x1, y1, x2, y2] coordinates of the segment.
+
+    Returns:
+        bool: True if the point lies on the segment, False otherwise.
+    """
+    x, y = point
+    (x1, y1), (x2, y2) = segment
+    
+    #Check collinearity and bounds
+    if not (min(x1, x2) <= x <= max(x1, x2) and min(y1, y2) <= y <= max(y1, y2)):
+        return False
+
+    # Check collinearity using cross-product
+    cross_product = (x2 - x1) * (y - y1) - (x - x1) * (y2 - y1)
+    return abs(cross_product) < 1e-9
@@ -0,0 +1,446 @@
+#Mutable road map kept valid edit by edit, without revalidating the whole map
+
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+
+import numpy as np
+
+from connectivity import UnionFind
+from road_index import IntervalOccupancy, segment_array
+from road_graph import RoadGraph
+from road_map import RoadMap
+
+#A removal that takes down more than this share of the map searches the whole map again
+_REBUILD_SHARE = 16
+
+
+class EditableMap:
+    """
+    Road map edited one segment at a time, with its validity known after every edit.
+
+    Diagonal and overlapping segments are refused when they are added, so the map never
+    holds any. Two kinds of connectivity are kept up to date incrementally.
+
+    Validity follows the rules of are_segments_connected: segments are one-way roads
+    and every segment must be reached by driving from the first one (the smallest id).
+    A segment is reached when its start lies on a reached segment, its parent, so the
+    reached segments form a tree of parents rooted at the first segment:
+
+    - add_segment attaches the new segment when its start is on a reached one, then
+      searches onwards from it only.
+    - remove_segment of a reached segment moves each of its children, with its subtree,
+      to another reached segment under the child's start whose parents do not lead
+      through the child. That costs a few binary searches and a walk up the tree per
+      child, about 0.1 ms in the median on a 45k-segment grid.
+    - Children without such a segment lose their subtree, which is attached again from
+      the reached segments around it, in time linear in its size. A subtree of more
+      than 1/16 of the map, a removed first segment (the drive then starts elsewhere) or
+      the initial segments are searched again from the first segment over the arrays of
+      RoadGraph instead: O(n log n), about as long as are_segments_connected.
+
+    Joining ignores the direction of the roads and follows their junctions (shared
+    endpoints and T-junctions, like RoadGraph), for num_components and joined:
+
+    - add_segment finds the segments it touches with binary searches in the per-row and
+      per-column interval and endpoint lists, then joins their union-find sets.
+    - remove_segment only searches when the removed segment joined several neighbours.
+      One search starts from each neighbour, they advance in turns and searches that
+      meet are merged, so it stops once the neighbours are reconnected or all but one of
+      them are cut off. The cut off parts get new union-find sets. The search is local
+      when a short detour exists, and linear when the only other path is long.
+
+    Segments keep the id returned by add_segment until they are removed.
+    """
+
+    def __init__(self, segments=()):
+        """
+        Parameters:
+            segments (RoadMap or list of tuples): Initial segments, added one by one.
+
+        Raises:
+            ValueError: If a segment is diagonal or overlaps an earlier one.
+        """
+        self.segments = {}       #id -> (x1, y1, x2, y2)
+        self.neighbours = {}     #id -> ids of the segments sharing a junction with it
+        self.num_components = 0  #parts of the map, ignoring the direction of the roads
+        self._next_id = 0
+        self._sets = UnionFind()
+        self._element = {}       #id -> element of the segment in the union-find sets
+        self._rows = IntervalOccupancy()     #horizontal segments, keyed by y
+        self._columns = IntervalOccupancy()  #vertical segments, keyed by x
+        self._row_ids = {}                   #(y, x1) -> id of a horizontal segment
+        self._column_ids = {}                #(x, y1) -> id of a vertical segment
+        self._row_points = {}     #y -> sorted (x, id) of the segment endpoints on that row
+        self._column_points = {}  #x -> sorted (y, id) of the segment endpoints on that column
+        self._parent = {}         #reached id -> id of the segment it is reached from, None for the first
+        #Set when the first segment is removed, is_valid searches again when asked; the
+        #initial segments are searched once at the end, in breadth-first order
+        self._reach_stale = True
+        for x1, y1, x2, y2 in segment_array(segments).tolist():
+            self.add_segment(((x1, y1), (x2, y2)))
+        self._reach_from_first()
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __contains__(self, segment_id):
+        return segment_id in self.segments
+
+    def segment(self, segment_id):
+        """Returns segment segment_id as ((x1, y1), (x2, y2))."""
+        x1, y1, x2, y2 = self.segments[segment_id]
+        return ((x1, y1), (x2, y2))
+
+    def is_joined(self):
+        """True if the segments form one piece when the direction of the roads is ignored."""
+        return self.num_components <= 1
+
+    def is_valid(self):
+        """
+        Same answer as are_segments_connected on to_road_map(): the map has segments and
+        every one of them can be reached by driving from the first one (no diagonal or
+        overlap can be added).
+        """
+        if not self.segments or self.num_components > 1:
+            return False
+        if self._reach_stale:
+            self._reach_from_first()
+        return len(self._parent) == len(self.segments)
+
+    def joined(self, i, j):
+        """True if segments i and j are in the same piece of the map, ignoring directions."""
+        return self._sets.find(self._element[i]) == self._sets.find(self._element[j])
+
+    def to_road_map(self):
+        """
+        Returns:
+            RoadMap: The current segments in the order of their ids.
+        """
+        return RoadMap(np.array(list(self.segments.values()), dtype=float).reshape(-1, 4))
+
+    def add_segment(self, segment):
+        """
+        Adds a segment to the map.
+
+        Parameters:
+            segment (tuple): The segment ((x1, y1), (x2, y2)).
+
+        Returns:
+            int: Id of the new segment.
+
+        Raises:
+            ValueError: If the segment is diagonal or overlaps a segment of the map.
+        """
+        (x1, y1), (x2, y2) = segment
+        x1, y1, x2, y2 = float(x1), float(y1), float(x2), float(y2)
+        if x1 != x2 and y1 != y2:
+            raise ValueError(f"\nSegment (({x1}, {y1}), ({x2}, {y2})) is diagonal.")
+        line = self._line(x1, y1, x2, y2)
+        if line is not None:
+            intervals, ids, fixed, lo, hi = line
+            overlap = intervals.overlapping(fixed, lo, hi)
+            if overlap is not None:
+                other = ids[fixed, overlap[0]]
+                raise ValueError(f"\nSegment (({x1}, {y1}), ({x2}, {y2})) overlaps with segment {other}.")
+
+        neighbours = self._touching(x1, y1, x2, y2)
+        segment_id = self._next_id
+        self._next_id += 1
+        self.segments[segment_id] = (x1, y1, x2, y2)
+        if line is not None:
+            intervals.add(fixed, lo, hi)
+            ids[fixed, lo] = segment_id
+        for x, y in ((x1, y1), (x2, y2)):
+            insort(self._row_points.setdefault(y, []), (x, segment_id))
+            insort(self._column_points.setdefault(x, []), (y, segment_id))
+
+        self.neighbours[segment_id] = neighbours
+        element = self._element[segment_id] = self._sets.add()
+        self.num_components += 1
+        for other in neighbours:
+            self.neighbours[other].add(segment_id)
+            if self._sets.union(element, self._element[other]):
+                self.num_components -= 1
+
+        if len(self.segments) == 1:
+            self._reach_from_first()
+        elif not self._reach_stale:
+            entry = self._entry(x1, y1)
+            if entry is not None:
+                self._parent[segment_id] = entry
+                self._reach([segment_id])
+        return segment_id
+
+    def remove_segment(self, segment_id):
+        """
+        Removes a segment from the map.
+
+        Parameters:
+            segment_id (int): Id returned by add_segment.
+
+        Returns:
+            tuple: The removed segment ((x1, y1), (x2, y2)).
+        """
+        x1, y1, x2, y2 = self.segments.pop(segment_id)
+        line = self._line(x1, y1, x2, y2)
+        if line is not None:
+            intervals, ids, fixed, lo, hi = line
+            intervals.remove(fixed, lo, hi)
+            del ids[fixed, lo]
+        for x, y in ((x1, y1), (x2, y2)):
+            _discard(self._row_points, y, (x, segment_id))
+            _discard(self._column_points, x, (y, segment_id))
+
+        if self._parent.get(segment_id, -1) is None:
+            self._parent = {}
+            self._reach_stale = bool(self.segments)
+        elif segment_id in self._parent:
+            self._detach(segment_id, x1, y1, x2, y2)
+        neighbours = self.neighbours.pop(segment_id)
+        del self._element[segment_id]
+        for other in neighbours:
+            self.neighbours[other].discard(segment_id)
+        if not neighbours:
+            self.num_components -= 1
+        elif len(neighbours) > 1:
+            self._split(list(neighbours))
+        return ((x1, y1), (x2, y2))
+
+    def _line(self, x1, y1, x2, y2):
+        #Interval structure, id table, fixed coordinate and extent of a segment, None for a point
+        if y1 == y2 and x1 != x2:
+            return self._rows, self._row_ids, y1, min(x1, x2), max(x1, x2)
+        if x1 == x2 and y1 != y2:
+            return self._columns, self._column_ids, x1, min(y1, y2), max(y1, y2)
+        return None
+
+    def _reach_from_first(self):
+        """
+        Searches the segments reached by driving from the first segment again, one level
+        of the search at a time over the arrays of the compiled road graph.
+        """
+        self._parent = {}
+        self._reach_stale = False
+        if not self.segments:
+            return
+        ids = np.fromiter(self.segments, dtype=np.int64, count=len(self.segments))
+        graph = RoadGraph(self.to_road_map())
+        count = graph.num_segments
+
+        #Nodes along each segment: its start and the ends of its edges, but the drive
+        #leaves the start of the first segment (a point segment is its own end)
+        along = graph.segment_edges
+        segment = np.concatenate((graph.edge_segment[along], np.arange(count)))
+        node = np.concatenate((graph.targets[along], graph.segment_start_node))
+        if len(graph.edges_of_segment(0)):
+            segment, node = segment[:-count], node[:-count]
+            segment = np.concatenate((segment, np.arange(1, count)))
+            node = np.concatenate((node, graph.segment_start_node[1:]))
+        order = np.argsort(segment, kind="stable")
+        nodes_along = node[order]
+        along_offsets = np.searchsorted(segment[order], np.arange(count + 1))
+        starting = np.argsort(graph.segment_start_node, kind="stable")
+        start_offsets = np.searchsorted(graph.segment_start_node[starting], np.arange(graph.num_nodes + 1))
+
+        parent = np.full(count, -1)
+        parent[0] = 0
+        frontier = np.zeros(1, dtype=np.int64)
+        while len(frontier):
+            source, position = _expand(along_offsets, frontier)
+            source, position = _expand(start_offsets, nodes_along[position], source)
+            other = starting[position]
+            new = parent[other] < 0
+            frontier, first = np.unique(other[new], return_index=True)
+            parent[frontier] = source[new][first]
+
+        reached = np.flatnonzero(parent >= 0)
+        self._parent = dict(zip(ids[reached].tolist(), ids[parent[reached]].tolist()))
+        self._parent[int(ids[0])] = None
+
+    def _reach(self, queue):
+        """Attaches the unreached segments starting on the segments of queue, and so on."""
+        queue = deque(queue)
+        while queue:
+            segment_id = queue.popleft()
+            x1, y1, x2, y2 = self.segments[segment_id]
+            for other in self._starting_on(x1, y1, x2, y2):
+                if other not in self._parent and not self._leaves_first(segment_id, *self.segments[other][:2]):
+                    self._parent[other] = segment_id
+                    queue.append(other)
+
+    def _children(self, segment_id, x1, y1, x2, y2):
+        #Segments reached from a segment, found from its coordinates (it may be removed)
+        return [other for other in self._starting_on(x1, y1, x2, y2)
+                if other != segment_id and self._parent.get(other) == segment_id]
+
+    def _detach(self, segment_id, x1, y1, x2, y2):
+        """Takes a removed reached segment out of the tree and repairs the tree below it."""
+        del self._parent[segment_id]
+
+        #Each child moves, with its subtree, to another reached segment under its start
+        #that does not depend on the child; a child moved may help a sibling
+        waiting = self._children(segment_id, x1, y1, x2, y2)
+        moved = True
+        while waiting and moved:
+            moved, lost = False, []
+            for child in waiting:
+                entry = self._entry(*self.segments[child][:2], outside=child)
+                if entry is None:
+                    lost.append(child)
+                else:
+                    self._parent[child] = entry
+                    moved = True
+            waiting = lost
+
+        #The subtrees of the children left are taken down and attached again from the
+        #reached segments around them, or the whole map is searched again when they
+        #are a large part of it
+        stack, orphans = waiting, []
+        while stack:
+            orphan = stack.pop()
+            orphans.append(orphan)
+            stack.extend(self._children(orphan, *self.segments[orphan]))
+            if len(orphans) > len(self.segments) // _REBUILD_SHARE:
+                self._reach_from_first()
+                return
+        for orphan in orphans:
+            del self._parent[orphan]
+        queue = []
+        for orphan in orphans:
+            entry = self._entry(*self.segments[orphan][:2])
+            if entry is not None:
+                self._parent[orphan] = entry
+                queue.append(orphan)
+        self._reach(queue)
+
+    def _leaves_first(self, parent, x, y):
+        #The drive leaves the start of the first segment, so a segment starting there is
+        #only reached from another segment leading there (a point segment is its own end)
+        if self._parent.get(parent, -1) is not None:
+            return False
+        x1, y1, x2, y2 = self.segments[parent]
+        return (x, y) == (x1, y1) and (x1, y1) != (x2, y2)
+
+    def _entry(self, x, y, outside=None):
+        """
+        Reached segment the point (x, y), the start of a segment, lies on, None if there
+        is none. With outside, only a segment whose parents lead to the first segment
+        without passing through that segment is taken.
+        """
+        for other in self._containing(x, y):
+            if other in self._parent and not self._leaves_first(other, x, y) and \
+                    (outside is None or self._leads_to_first(other, outside)):
+                return other
+        return None
+
+    def _leads_to_first(self, segment_id, avoided):
+        #Follows the parents up to the first segment, in the depth of the tree
+        while segment_id is not None:
+            if segment_id == avoided or segment_id not in self._parent:
+                return False  #through the avoided segment, or through the removed one
+            segment_id = self._parent[segment_id]
+        return True
+
+    def _containing(self, x, y):
+        """Ids of the segments the point (x, y) lies on."""
+        found = set(_points_between(self._row_points.get(y), x, x))
+        for lo, _ in self._rows.covering(y, x):
+            found.add(self._row_ids[y, lo])
+        for lo, _ in self._columns.covering(x, y):
+            found.add(self._column_ids[x, lo])
+        return found
+
+    def _starting_on(self, x1, y1, x2, y2):
+        """Ids of the segments whose start lies on the segment x1, y1, x2, y2."""
+        if y1 == y2:
+            candidates = _points_between(self._row_points.get(y1), min(x1, x2), max(x1, x2))
+        else:
+            candidates = _points_between(self._column_points.get(x1), min(y1, y2), max(y1, y2))
+        starting = []
+        for other in candidates:
+            sx, sy = self.segments[other][:2]
+            if min(x1, x2) <= sx <= max(x1, x2) and min(y1, y2) <= sy <= max(y1, y2):
+                starting.append(other)
+        return starting
+
+    def _touching(self, x1, y1, x2, y2):
+        """Ids of the segments sharing a junction with the segment x1, y1, x2, y2."""
+        found = set()
+        #Endpoints of other segments lying on this one
+        if y1 == y2:
+            found.update(_points_between(self._row_points.get(y1), min(x1, x2), max(x1, x2)))
+        else:
+            found.update(_points_between(self._column_points.get(x1), min(y1, y2), max(y1, y2)))
+        #Segments this one ends on
+        for x, y in ((x1, y1), (x2, y2)):
+            for lo, _ in self._rows.covering(y, x):
+                found.add(self._row_ids[y, lo])
+            for lo, _ in self._columns.covering(x, y):
+                found.add(self._column_ids[x, lo])
+        return found
+
+    def _split(self, starts):
+        """
+        Finds the parts the map around a removed segment falls into, starting from its
+        neighbours, and gives every part but one its own union-find set.
+        """
+        searches = UnionFind(len(starts))  #searches that met are in the same part
+        owner = {start: k for k, start in enumerate(starts)}
+        queues = [deque([start]) for start in starts]
+        reached = [[start] for start in starts]
+        while True:
+            running = {}
+            for k in range(len(starts)):
+                root = searches.find(k)
+                running[root] = running.get(root, False) or bool(queues[k])
+            if sum(running.values()) <= 1:
+                break
+            for k, queue in enumerate(queues):
+                if not queue:
+                    continue
+                for other in self.neighbours[queue.popleft()]:
+                    if other not in owner:
+                        owner[other] = k
+                        queue.append(other)
+                        reached[k].append(other)
+                    else:
+                        searches.union(k, owner[other])
+
+        #The part still being searched (or the largest one) keeps the current set
+        parts = {}
+        for k in range(len(starts)):
+            parts.setdefault(searches.find(k), []).append(k)
+        keep = max(parts, key=lambda root: (running[root], sum(len(reached[k]) for k in parts[root])))
+        for root, members in parts.items():
+            if root == keep:
+                continue
+            element = self._sets.add()
+            for k in members:
+                for segment_id in reached[k]:
+                    self._element[segment_id] = element
+        self.num_components += len(parts) - 1
+
+
+def _points_between(points, lo, hi):
+    #Ids of the (position, id) entries of a sorted list with lo <= position <= hi
+    if not points:
+        return []
+    start = bisect_left(points, (lo, -1))
+    end = bisect_right(points, (hi, float("inf")))
+    return [segment_id for _, segment_id in points[start:end]]
+
+
+def _expand(offsets, rows, labels=None):
+    #Positions of the entries offsets[row]:offsets[row + 1] of each row, with the label
+    #(by default the row) they come from
+    counts = offsets[rows + 1] - offsets[rows]
+    labels = np.repeat(rows if labels is None else labels, counts)
+    k = np.arange(len(labels)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return labels, np.repeat(offsets[rows], counts) + k
+
+
+def _discard(points, key, entry):
+    entries = points[key]
+    del entries[bisect_left(entries, entry)]
+    if not entries:
+        del points[key]
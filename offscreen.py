@@ -0,0 +1,315 @@
+#Offscreen rendering of the map and cars into image buffers, with PNG export
+
+"""
+Draws what SimWindow shows (roads, junctions, bridges and cars over the background
+grid) into NumPy image buffers, without dearpygui or a display, and writes the frames
+as PNG files with zlib only. Batch runs on servers without a display use it to export
+frame sequences of a simulation.
+"""
+
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from road_index import find_bridges
+from road_map import HORIZONTAL, VERTICAL, CarSet, RoadMap
+
+
+def world_to_screen(x, y, zoom, offset, width, height):
+    """
+    Transform of the viewer from world coordinates to canvas pixels, for numbers or arrays.
+
+    Parameters:
+        x, y (float or numpy.ndarray): World coordinates.
+        zoom (float): Pixels per world unit.
+        offset (tuple): World translation (x, y) applied before the zoom.
+        width, height (int): Size of the canvas in pixels.
+
+    Returns:
+        tuple: The (x, y) canvas coordinates.
+    """
+    return width / 2 + (x + offset[0]) * zoom, height / 2 + (y + offset[1]) * zoom
+
+
+def screen_to_world(x, y, zoom, offset, width, height):
+    """Inverse of world_to_screen."""
+    return (x - width / 2) / zoom - offset[0], (y - height / 2) / zoom - offset[1]
+
+
+def write_png(file_path, image, compress_level=1):
+    """
+    Writes an RGB image to a PNG file.
+
+    Parameters:
+        file_path (str): Path of the file.
+        image (numpy.ndarray): uint8 array of shape (height, width, 3).
+        compress_level (int): zlib level from 0 to 9, 1 is the fastest that still
+            shrinks the flat colours of a map well.
+    """
+    height, width, _ = image.shape
+    raw = np.empty((height, 1 + 3 * width), dtype=np.uint8)
+    raw[:, 0] = 0  #no filter on any row
+    raw[:, 1:] = image.reshape(height, -1)
+    with open(file_path, 'wb') as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        _write_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        _write_chunk(file, b"IDAT", zlib.compress(raw, compress_level))
+        _write_chunk(file, b"IEND", b"")
+
+
+def _write_chunk(file, kind, data):
+    file.write(struct.pack(">I", len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+class OffscreenRenderer:
+    """
+    Draws the map and the cars into an RGB image with the transform, colours and sizes
+    of SimWindow (roads 5 units wide, junctions, bridges and cars of radius 2.5).
+
+    Everything that only depends on the view is rasterized once into a cached layer:
+    the roads are rectangles summed in a 2D difference array, the junctions and bridge
+    points are discs stamped with one indexed assignment per chunk. A frame copies the
+    layer, stamps the cars and puts the bridges back on top of them, so its cost only
+    grows with the number of cars in view. Diagonal segments, which valid maps never
+    contain, are not drawn.
+    """
+
+    road_width = 5  #world units
+    radius = 2.5  #world units, of junctions, bridge points and cars
+    junction_min_radius = 1.5  #pixels, smaller junctions are skipped like in SimWindow
+    grid_min_pixels = 8  #finest grid spacing on screen
+    background_color = (250, 250, 250)
+    road_color = (180, 180, 220)
+    junction_color = (220, 220, 220)
+    car_color = (255, 0, 0)
+    bridge_color = (0, 0, 0)
+    stamp_chunk = 1 << 22  #pixel indices written at once, bounds the memory of a stamp
+
+    def __init__(self, segs, cars, width=1280, height=720, zoom=2, offset=(-200, -100),
+                 draw_bridges=False, draw_grid=True):
+        """
+        Parameters:
+            segs (RoadMap or list of tuples): The road map, not copied when it is a RoadMap or an array.
+            cars (CarSet, array or list of tuples): Car positions, read again at every frame
+                (the positions of a CarSet or an array are shared, not copied).
+            width, height (int): Size of the image in pixels.
+            zoom (float): Pixels per world unit.
+            offset (tuple): World translation (x, y), see world_to_screen.
+            draw_bridges (bool): Draw the crossings that are not junctions.
+            draw_grid (bool): Draw the axes and the grid behind the map.
+        """
+        self.segments = RoadMap.from_segments(segs)
+        self.vehicles = cars.positions if isinstance(cars, CarSet) else cars
+        self.speed = None
+        self.width = width
+        self.height = height
+        self.zoom = zoom
+        self.offset = offset
+        self.draw_bridges = draw_bridges
+        self.draw_grid = draw_grid
+        self._bridges = None
+        self._layer_view = None
+        self._layer = None
+        self._frame = None
+        self._pad = 0
+        self._bridge_pixels = None
+
+    def fit(self, margin=0.05):
+        """
+        Sets the zoom and the offset so the whole map is in view.
+
+        Parameters:
+            margin (float): Share of the image left empty on each side.
+        """
+        coords = self.segments.coords
+        if len(coords) == 0:
+            return
+        xs, ys = coords[:, 0::2], coords[:, 1::2]
+        x_min, x_max, y_min, y_max = xs.min(), xs.max(), ys.min(), ys.max()
+        self.zoom = (1 - 2 * margin) * min(self.width / (x_max - x_min + self.road_width),
+                                           self.height / (y_max - y_min + self.road_width))
+        self.offset = (-(x_min + x_max) / 2, -(y_min + y_max) / 2)
+
+    def to_screen(self, x, y):
+        """World coordinates to image pixels."""
+        return world_to_screen(x, y, self.zoom, self.offset, self.width, self.height)
+
+    def to_world(self, x, y):
+        """Image pixels to world coordinates."""
+        return screen_to_world(x, y, self.zoom, self.offset, self.width, self.height)
+
+    def render(self):
+        """
+        Draws one frame with the current car positions.
+
+        Returns:
+            numpy.ndarray: uint8 array of shape (height, width, 3), overwritten by the next frame.
+        """
+        view = (self.zoom, self.offset, self.width, self.height, self.draw_bridges, self.draw_grid)
+        if view != self._layer_view:
+            self._draw_layer()
+            self._layer_view = view
+        np.copyto(self._frame, self._layer)
+        pixels = self._frame.reshape(-1, 3)
+        cars = np.asarray(self.vehicles, dtype=float).reshape(-1, 2)
+        self._stamp(pixels, cars, self.radius * self.zoom, self.car_color)
+        if self._bridge_pixels is not None:
+            pixels[self._bridge_pixels] = self.bridge_color
+        pad = self._pad
+        return self._frame[pad:pad + self.height, pad:pad + self.width]
+
+    def record(self, directory, frames, updatecar=None, prefix="frame", compress_level=1):
+        """
+        Renders frames and writes them as numbered PNG files.
+
+        Parameters:
+            directory (str): Folder of the files, created if needed.
+            frames (int): Number of frames.
+            updatecar (function): Called as updatecar(carposition, carspeed, segments)
+                between two frames, like the hook of SimWindow.show.
+            prefix (str): Start of the file names, followed by the frame number.
+            compress_level (int): zlib level of the PNG files.
+
+        Returns:
+            list of str: The files written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for k in range(frames):
+            if k and updatecar is not None:
+                updatecar(self.vehicles, self.speed, self.segments)
+            file_path = os.path.join(directory, f"{prefix}_{k:05d}.png")
+            write_png(file_path, self.render(), compress_level)
+            files.append(file_path)
+        return files
+
+    def _draw_layer(self):
+        #Background, grid, roads, junctions and bridges of the current view
+        self._pad = pad = math.ceil(self.radius * self.zoom) + 1  #room for discs crossing the border
+        shape = (self.height + 2 * pad, self.width + 2 * pad)
+        self._layer = np.empty(shape + (3,), dtype=np.uint8)
+        self._layer[:] = self.background_color
+        self._frame = np.empty_like(self._layer)
+        pixels = self._layer.reshape(-1, 3)
+        if self.draw_grid:
+            self._draw_axes_and_grid()
+
+        coords = self.segments.coords
+        if len(coords):
+            ends = self._padded(coords[:, 0::2], coords[:, 1::2])
+            self._fill_lines(pixels, ends, self.segments.orientation, self.road_color)
+            radius = self.radius * self.zoom
+            if radius >= self.junction_min_radius:
+                self._stamp(pixels, coords.reshape(-1, 2), radius, self.junction_color)
+
+        self._bridge_pixels = None
+        if self.draw_bridges:
+            if self._bridges is None:
+                self._bridges = find_bridges(self.segments)
+            points, overlaps = self._bridges
+            mask = np.zeros(shape, dtype=bool)
+            marks = mask.reshape(-1, 1)
+            if overlaps:
+                overlaps = np.array(overlaps, dtype=float).reshape(-1, 4)
+                ends = self._padded(overlaps[:, 0::2], overlaps[:, 1::2])
+                self._fill_lines(marks, ends, RoadMap(overlaps).orientation, True)
+            if points:
+                points = np.array(points, dtype=float).reshape(-1, 2)
+                self._stamp(marks, points, self.radius * self.zoom, True)
+            self._bridge_pixels = np.flatnonzero(mask)
+            pixels[self._bridge_pixels] = self.bridge_color
+
+    def _padded(self, xs, ys):
+        #Pixel coordinates in the padded buffers of world coordinates
+        xs, ys = self.to_screen(xs, ys)
+        return xs + self._pad, ys + self._pad
+
+    def _draw_axes_and_grid(self):
+        #Same lines as SimWindow._draw_overlay, blended over the background
+        x_center, y_center = self._padded(0.0, 0.0)
+        x_center, y_center = round(x_center), round(y_center)
+        self._blend_lines(np.array([x_center - 1, x_center]), np.array([y_center - 1, y_center]), 80)
+        unit = 10
+        while unit * self.zoom < self.grid_min_pixels:
+            unit *= 5
+        for step in (unit, 5 * unit):
+            x_start, y_start = self.to_world(-self._pad, -self._pad)
+            x_end, y_end = self.to_world(self.width + self._pad, self.height + self._pad)
+            xs = step * np.arange(np.ceil(x_start / step), np.floor(x_end / step) + 1)
+            ys = step * np.arange(np.ceil(y_start / step), np.floor(y_end / step) + 1)
+            xs, ys = self._padded(xs, ys)
+            self._blend_lines(np.round(xs).astype(np.int64), np.round(ys).astype(np.int64), 50)
+
+    def _blend_lines(self, columns, rows, opacity):
+        #Darkens whole pixel columns and rows like black lines of the given opacity (0 to 255)
+        keep = 1 - opacity / 255
+        layer = self._layer
+        columns = columns[(columns >= 0) & (columns < layer.shape[1])]
+        rows = rows[(rows >= 0) & (rows < layer.shape[0])]
+        layer[:, columns] = (layer[:, columns] * keep).astype(np.uint8)
+        layer[rows] = (layer[rows] * keep).astype(np.uint8)
+
+    def _fill_lines(self, pixels, ends, orientation, color):
+        """
+        Fills the horizontal and vertical lines of width road_width between the ends
+        ((x1, x2), (y1, y2)) in pixels, as rectangles summed in a 2D difference array.
+        """
+        (x1, x2), (y1, y2) = ends[0].T, ends[1].T
+        half = self.road_width * self.zoom / 2
+        horizontal = orientation == HORIZONTAL
+        vertical = orientation == VERTICAL
+        left = np.where(horizontal, np.minimum(x1, x2), x1 - half)
+        right = np.where(horizontal, np.maximum(x1, x2), x1 + half)
+        top = np.where(vertical, np.minimum(y1, y2), y1 - half)
+        bottom = np.where(vertical, np.maximum(y1, y2), y1 + half)
+        lines = horizontal | vertical
+
+        height, width = self._layer.shape[:2]
+        #At least one pixel across, so thin roads stay visible when zoomed out
+        j0 = np.clip(np.round(left), 0, width).astype(np.int64)
+        j1 = np.clip(np.maximum(np.round(right), np.round(left) + 1), 0, width).astype(np.int64)
+        i0 = np.clip(np.round(top), 0, height).astype(np.int64)
+        i1 = np.clip(np.maximum(np.round(bottom), np.round(top) + 1), 0, height).astype(np.int64)
+        keep = lines & (j0 < j1) & (i0 < i1)
+        j0, j1, i0, i1 = j0[keep], j1[keep], i0[keep], i1[keep]
+
+        size = (height + 1) * (width + 1)
+        stride = width + 1
+        delta = np.bincount(np.concatenate((i0 * stride + j0, i1 * stride + j1)), minlength=size)
+        delta -= np.bincount(np.concatenate((i0 * stride + j1, i1 * stride + j0)), minlength=size)
+        covered = delta.reshape(height + 1, width + 1).cumsum(axis=0).cumsum(axis=1)[:height, :width] > 0
+        pixels[covered.ravel()] = color
+
+    def _stamp(self, pixels, points, radius, color):
+        """Draws discs of a radius in pixels (at least one pixel) centered on world points (n, 2)."""
+        if len(points) == 0:
+            return
+        height, width = self._layer.shape[:2]
+        reach = math.ceil(radius)
+        #Pixel of each center, shifted by reach so one unsigned comparison per axis culls it
+        x0, y0 = self._padded(0.0, 0.0)
+        cx = np.floor(points[:, 0] * self.zoom + (x0 - reach)).astype(np.int64)
+        cy = np.floor(points[:, 1] * self.zoom + (y0 - reach)).astype(np.int64)
+        inside = (cx.view(np.uint64) < width - 2 * reach) & (cy.view(np.uint64) < height - 2 * reach)
+        cy *= width
+        cy += cx
+        centers = cy[inside]
+        centers += reach * width + reach
+
+        dy, dx = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+        disc = dx ** 2 + dy ** 2 <= max(radius, 0.5) ** 2
+        offsets = (dy[disc] * width + dx[disc]).astype(np.int64)
+        if len(centers) * len(offsets) > height * width:
+            #More stamped pixels than the image holds: drop the centers drawn twice
+            marks = np.zeros(height * width, dtype=bool)
+            marks[centers] = True
+            centers = np.flatnonzero(marks)
+        per_chunk = max(1, self.stamp_chunk // len(offsets))
+        for start in range(0, len(centers), per_chunk):
+            pixels[(centers[start:start + per_chunk, None] + offsets).ravel()] = color
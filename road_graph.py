@@ -0,0 +1,189 @@
+#Road network compiled from a list of segments
+
+import numpy as np
+
+from road_index import grouped_bisect, segment_array
+
+
+class RoadGraph:
+    """
+    Compact road graph compiled from axis-aligned segments.
+
+    Nodes are the distinct segment endpoints (junctions). Every segment is split at the
+    endpoints of other segments lying inside it (T-junctions), and each piece becomes a
+    directed edge running the same way as its segment. Outgoing edges are stored in CSR
+    form: the edges leaving node v are offsets[v]:offsets[v + 1] of the edge arrays
+    (sources, targets, lengths, orientation, edge_segment, edge_offset).
+    """
+
+    def __init__(self, segments):
+        """
+        Parameters:
+            segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+
+        Raises:
+            ValueError: If a segment is diagonal.
+        """
+        segs = segment_array(segments) + 0.0  #+ 0.0 turns -0.0 into 0.0 so equal points match
+        x1, y1, x2, y2 = segs.T
+        if np.any((x1 != x2) & (y1 != y2)):
+            raise ValueError("\nSegments must be strictly horizontal or vertical.")
+        self.segments = segs
+        self.num_segments = len(segs)
+
+        #Nodes: distinct endpoints, sorted by (x, y)
+        points = segs.reshape(-1, 2)
+        order = np.lexsort((points[:, 1], points[:, 0]))
+        sorted_points = points[order]
+        new = np.ones(len(points), dtype=bool)
+        new[1:] = (sorted_points[1:] != sorted_points[:-1]).any(axis=1)
+        self.nodes = sorted_points[new]
+        node_of = np.empty(len(points), dtype=np.int64)
+        node_of[order] = np.cumsum(new) - 1
+        self.segment_start_node = node_of[0::2]
+        self.segment_end_node = node_of[1::2]
+
+        sources, targets, edge_segment = self._split_segments(x1, y1, x2, y2)
+
+        #Pieces of zero length (single point segments) are not edges
+        delta = self.nodes[targets] - self.nodes[sources]
+        lengths = np.abs(delta).sum(axis=1)
+        keep = lengths > 0
+        sources, targets, edge_segment = sources[keep], targets[keep], edge_segment[keep]
+        lengths = lengths[keep]
+        edge_offset = np.abs(self.nodes[sources] - segs[edge_segment, :2]).sum(axis=1)
+
+        #CSR order: edges grouped by source node
+        csr = np.argsort(sources, kind="stable")
+        self.sources = sources[csr]
+        self.targets = targets[csr]
+        self.lengths = lengths[csr]
+        self.orientation = (delta[keep][csr, 0] == 0).astype(np.int8)  #0 horizontal, 1 vertical
+        self.edge_segment = edge_segment[csr]
+        self.edge_offset = edge_offset[csr]
+        self.offsets = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.sources, minlength=len(self.nodes)), out=self.offsets[1:])
+
+        #Edges of each segment, in order along the segment
+        by_segment = np.lexsort((self.edge_offset, self.edge_segment))
+        self.segment_edges = by_segment
+        self.segment_edge_offsets = np.zeros(self.num_segments + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.edge_segment, minlength=self.num_segments),
+                  out=self.segment_edge_offsets[1:])
+
+    def _split_segments(self, x1, y1, x2, y2):
+        #Interior nodes of each segment form a contiguous run in the nodes sorted by
+        #(x, y) for vertical segments, or by (y, x) for horizontal ones
+        vertical = x1 == x2
+        fixed = np.where(vertical, x1, y1)
+        lo = np.where(vertical, np.minimum(y1, y2), np.minimum(x1, x2))
+        hi = np.where(vertical, np.maximum(y1, y2), np.maximum(x1, x2))
+
+        by_x = np.arange(len(self.nodes))
+        by_y = np.lexsort((self.nodes[:, 0], self.nodes[:, 1]))
+        first = np.zeros(len(x1), dtype=np.int64)
+        count = np.zeros(len(x1), dtype=np.int64)
+        for mask, order, key, along in ((vertical, by_x, 0, 1), (~vertical, by_y, 1, 0)):
+            keys = self.nodes[order, key]
+            values = self.nodes[order, along]
+            group_start = np.searchsorted(keys, fixed[mask], side="left")
+            group_end = np.searchsorted(keys, fixed[mask], side="right")
+            a = grouped_bisect(values, group_start, group_end, lo[mask], side="right")
+            b = grouped_bisect(values, group_start, group_end, hi[mask], side="left")
+            first[mask] = a
+            count[mask] = np.maximum(b - a, 0)
+
+        #Point sequence of each segment: start, interior nodes in driving order, end
+        n_points = count + 2
+        seq_start = np.concatenate(([0], np.cumsum(n_points)[:-1]))
+        segment = np.repeat(np.arange(len(x1)), n_points)
+        rank = np.arange(int(n_points.sum())) - seq_start[segment]
+        k = count[segment]
+        increasing = np.where(vertical, y2 >= y1, x2 >= x1)[segment]
+        position = first[segment] + np.where(increasing, rank - 1, k - rank)
+        interior = (rank > 0) & (rank <= k)
+        sequence = np.where(rank == 0, self.segment_start_node[segment], self.segment_end_node[segment])
+        interior_vertical = interior & vertical[segment]
+        interior_horizontal = interior & ~vertical[segment]
+        sequence[interior_vertical] = by_x[position[interior_vertical]]
+        sequence[interior_horizontal] = by_y[position[interior_horizontal]]
+
+        #Edges link consecutive points of the same segment
+        not_last = rank < k + 1
+        return sequence[:-1][not_last[:-1]], sequence[1:][not_last[:-1]], segment[:-1][not_last[:-1]]
+
+    @property
+    def num_nodes(self):
+        return len(self.nodes)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    def out_edges(self, node):
+        """Returns the ids of the edges leaving a node."""
+        return np.arange(self.offsets[node], self.offsets[node + 1])
+
+    def edges_of_segment(self, segment):
+        """Returns the ids of the edges of a segment, in order along the segment."""
+        return self.segment_edges[self.segment_edge_offsets[segment]:self.segment_edge_offsets[segment + 1]]
+
+    def locate(self, segment_ids, offsets):
+        """
+        Converts positions given as (segment, distance from the segment start) to
+        (edge, distance from the edge start).
+
+        Returns:
+            tuple: (edge_ids, edge_offsets), edge id -1 for a point on a segment
+            without edges that no edge leaves from either.
+        """
+        segment_ids = np.asarray(segment_ids, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=float)
+        starts = self.segment_edge_offsets[segment_ids]
+        ends = self.segment_edge_offsets[segment_ids + 1]
+        k = np.maximum(grouped_bisect(self.edge_offset[self.segment_edges], starts, ends, offsets) - 1, starts)
+        has_edges = ends > starts
+        edges = np.full(len(segment_ids), -1, dtype=np.int64)
+        edges[has_edges] = self.segment_edges[k[has_edges]]
+
+        #Single point segments: use an edge leaving that point if there is one
+        node = self.segment_start_node[segment_ids[~has_edges]]
+        leaves = self.offsets[node + 1] > self.offsets[node]
+        fallback = np.where(leaves, self.offsets[node], -1)
+        edges[~has_edges] = fallback
+
+        edge_offsets = np.zeros(len(segment_ids))
+        on_edge = edges >= 0
+        edge_offsets[has_edges] = offsets[has_edges] - self.edge_offset[edges[has_edges]]
+        edge_offsets[on_edge] = np.clip(edge_offsets[on_edge], 0, self.lengths[edges[on_edge]])
+        return edges, edge_offsets
+
+    def positions(self, edge_ids, offsets):
+        """Returns the (x, y) points at the given distances along the given edges, as an (N, 2) array."""
+        start = self.nodes[self.sources[edge_ids]]
+        direction = (self.nodes[self.targets[edge_ids]] - start) / self.lengths[edge_ids, None]
+        return start + direction * np.asarray(offsets, dtype=float)[:, None]
+
+    def reachable_nodes(self, start):
+        """
+        Finds the nodes that can be reached from a node by driving along the edges.
+
+        Parameters:
+            start (int or sequence of ints): The node, or several nodes, to start from.
+
+        Returns:
+            numpy.ndarray: Boolean mask over the nodes.
+        """
+        offsets = self.offsets.tolist()
+        targets = self.targets.tolist()
+        visited = bytearray(len(self.nodes))
+        stack = np.atleast_1d(start).tolist()
+        for node in stack:
+            visited[node] = 1
+        while stack:
+            node = stack.pop()
+            for target in targets[offsets[node]:offsets[node + 1]]:
+                if not visited[target]:
+                    visited[target] = 1
+                    stack.append(target)
+        return np.frombuffer(bytes(visited), dtype=bool).copy()
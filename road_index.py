@@ -0,0 +1,884 @@
+#Spatial index over the road segments of a map
+
+import heapq
+from bisect import bisect_left, bisect_right, insort
+
+import numpy as np
+
+
+def segment_array(segments):
+    """
+    Converts segments to a contiguous float array.
+
+    Parameters:
+        segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+
+    Returns:
+        numpy.ndarray: Array of shape (n, 4) holding x1, y1, x2, y2 for each segment.
+    """
+    return np.asarray(segments, dtype=float).reshape(-1, 4)
+
+
+def point_array(points):
+    """
+    Converts points (for example car positions) to a contiguous float array.
+
+    Parameters:
+        points (list of tuples or array): Each point is (x, y).
+
+    Returns:
+        numpy.ndarray: Array of shape (n, 2) holding x, y for each point.
+    """
+    return np.asarray(points, dtype=float).reshape(-1, 2)
+
+
+def grouped_bisect(values, starts, ends, queries, side="right"):
+    """
+    Vectorized bisect of each query inside its own sorted slice of values.
+
+    Parameters:
+        values (numpy.ndarray): Array that is sorted inside every slice [start, end).
+        starts (numpy.ndarray): Start index of the slice for each query.
+        ends (numpy.ndarray): End index (exclusive) of the slice for each query.
+        queries (numpy.ndarray): Value searched for in each slice.
+        side (str): "right" like bisect_right, "left" like bisect_left.
+
+    Returns:
+        numpy.ndarray: For each query, the index of the first value in its slice that is
+        greater than the query, or greater or equal for side "left" (ends if there is none).
+    """
+    lo = np.array(starts, dtype=np.int64)
+    hi = np.array(ends, dtype=np.int64)
+    active = lo < hi
+    while active.any():
+        mid = (lo + hi) // 2
+        go_right = np.zeros(len(lo), dtype=bool)
+        if side == "right":
+            go_right[active] = values[mid[active]] <= queries[active]
+        else:
+            go_right[active] = values[mid[active]] < queries[active]
+        lo = np.where(active & go_right, mid + 1, lo)
+        hi = np.where(active & ~go_right, mid, hi)
+        active = lo < hi
+    return lo
+
+
+class IntervalGroups:
+    """
+    Intervals grouped by a fixed coordinate and sorted inside each group.
+
+    For vertical roads the fixed coordinate is x and the intervals run along y,
+    for horizontal roads it is y and the intervals run along x.
+    """
+
+    def __init__(self, fixed, lo, hi, ids=None):
+        order = np.lexsort((lo, fixed))
+        self.fixed = np.asarray(fixed, dtype=float)[order]
+        self.lo = np.asarray(lo, dtype=float)[order]
+        self.hi = np.asarray(hi, dtype=float)[order]
+        self.ids = (np.arange(len(order)) if ids is None else np.asarray(ids))[order]
+
+        #One key per fixed coordinate, offsets delimit the intervals of each key
+        self.keys, starts = np.unique(self.fixed, return_index=True)
+        self.offsets = np.append(starts, len(self.fixed)).astype(np.int64)
+        group = np.repeat(np.arange(len(self.keys)), np.diff(self.offsets))
+
+        #reach[i] is the largest hi among the intervals of the group up to i.
+        #Ranking by (group, hi) keeps later groups above earlier ones, so one global
+        #running maximum over the ranks never leaks across groups.
+        by_hi = np.lexsort((self.hi, group))
+        rank = np.empty(len(by_hi), dtype=np.int64)
+        rank[by_hi] = np.arange(len(by_hi))
+        reach_at = by_hi[np.maximum.accumulate(rank)] if len(rank) else by_hi
+        self.reach = self.hi[reach_at]
+        self.reach_ids = self.ids[reach_at]  #interval that reaches furthest, it covers the point
+
+    def __len__(self):
+        return len(self.fixed)
+
+    def group_slices(self, fixed):
+        """
+        Finds the group of each queried fixed coordinate.
+
+        Parameters:
+            fixed (numpy.ndarray): Fixed coordinate of each query.
+
+        Returns:
+            tuple: (found, starts, ends) where found flags the queries that have a group
+            and [starts, ends) is the slice of that group (empty when not found).
+        """
+        if len(self.keys) == 0:
+            empty = np.zeros(len(fixed), dtype=np.int64)
+            return np.zeros(len(fixed), dtype=bool), empty, empty
+
+        g = np.minimum(np.searchsorted(self.keys, fixed), len(self.keys) - 1)
+        found = self.keys[g] == fixed
+        starts = np.where(found, self.offsets[g], 0)
+        ends = np.where(found, self.offsets[g + 1], 0)
+        return found, starts, ends
+
+    def covers(self, fixed, pos):
+        """
+        Checks which queried points are covered by an interval of their group.
+
+        Parameters:
+            fixed (numpy.ndarray): Fixed coordinate of each point.
+            pos (numpy.ndarray): Coordinate of each point along the intervals.
+
+        Returns:
+            numpy.ndarray: Boolean mask, True where the point lies on an interval.
+        """
+        return self.find(fixed, pos) >= 0
+
+    def find(self, fixed, pos):
+        """
+        Finds an interval covering each queried point.
+
+        Parameters:
+            fixed (numpy.ndarray): Fixed coordinate of each point.
+            pos (numpy.ndarray): Coordinate of each point along the intervals.
+
+        Returns:
+            numpy.ndarray: Id of an interval covering each point, -1 where there is none.
+        """
+        fixed = np.asarray(fixed, dtype=float)
+        pos = np.asarray(pos, dtype=float)
+        found, starts, ends = self.group_slices(fixed)
+        last = grouped_bisect(self.lo, starts, ends, pos) - 1
+        hit = found & (last >= starts)
+        hit[hit] = self.reach[last[hit]] >= pos[hit]
+        ids = np.full(len(pos), -1, dtype=np.int64)
+        ids[hit] = self.reach_ids[last[hit]]
+        return ids
+
+
+class IntervalOccupancy:
+    """
+    Mutable per-row (or per-column) occupancy of non-overlapping intervals.
+
+    Each fixed coordinate keeps its intervals as two parallel sorted lists of starts
+    and ends, so a free-space check is one binary search in that row only.
+    """
+
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+
+    def conflicts(self, fixed, lo, hi, margin=0):
+        """
+        Checks whether [lo, hi] comes within margin of an interval on the same row.
+
+        Parameters:
+            fixed (float): Fixed coordinate of the row or column.
+            lo (float): Start of the interval, lo <= hi.
+            hi (float): End of the interval.
+            margin (float): Minimum distance required between the intervals.
+
+        Returns:
+            bool: True if an occupied interval is closer than the margin (or touches).
+        """
+        starts = self.starts.get(fixed)
+        if not starts:
+            return False
+        #First interval that ends at or after lo - margin, it is the only candidate
+        k = bisect_left(self.ends[fixed], lo - margin)
+        return k < len(starts) and starts[k] <= hi + margin
+
+    def add(self, fixed, lo, hi):
+        """Marks [lo, hi] as occupied on the given row or column."""
+        starts = self.starts.setdefault(fixed, [])
+        ends = self.ends.setdefault(fixed, [])
+        k = bisect_left(starts, lo)
+        starts.insert(k, lo)
+        ends.insert(k, hi)
+
+    def remove(self, fixed, lo, hi):
+        """Frees the interval [lo, hi] added earlier on the given row or column."""
+        starts, ends = self.starts[fixed], self.ends[fixed]
+        k = bisect_left(starts, lo)
+        while ends[k] != hi:  #touching single points may share their start with an interval
+            k += 1
+        del starts[k], ends[k]
+        if not starts:
+            del self.starts[fixed], self.ends[fixed]
+
+    def overlapping(self, fixed, lo, hi):
+        """
+        Finds an interval sharing more than an endpoint with [lo, hi], for intervals
+        that do not overlap each other.
+
+        Returns:
+            tuple: (start, end) of an overlapping interval, None if there is none.
+        """
+        starts = self.starts.get(fixed)
+        if not starts or lo == hi:
+            return None
+        ends = self.ends[fixed]
+        k = bisect_right(ends, lo)  #first interval ending after lo
+        while k < len(starts) and starts[k] < hi:
+            if starts[k] < ends[k]:  #single points never overlap
+                return starts[k], ends[k]
+            k += 1
+        return None
+
+    def covering(self, fixed, pos):
+        """
+        Finds the intervals containing a point, for intervals that do not overlap each other.
+
+        Returns:
+            list of tuples: (start, end) of each interval with start <= pos <= end.
+        """
+        starts = self.starts.get(fixed)
+        if not starts:
+            return []
+        ends = self.ends[fixed]
+        found = []
+        k = bisect_left(ends, pos)
+        while k < len(starts) and starts[k] <= pos:
+            found.append((starts[k], ends[k]))
+            k += 1
+        return found
+
+
+class RoadIndex:
+    """
+    Index of road segments answering point-on-road queries in O(log n) per point.
+
+    Vertical segments are grouped by their x coordinate and horizontal segments by
+    their y coordinate. Segments that are neither (diagonal) are kept aside and checked
+    directly, they are rejected by map validation so there are normally none.
+    Nearest-road queries use a SegmentGrid, built on the first query, and a SegmentTree
+    for the points the grid leaves open, built the first time there are some.
+    """
+
+    def __init__(self, segments):
+        """
+        Parameters:
+            segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+        """
+        self.segments = segment_array(segments)
+        x1, y1, x2, y2 = self.segments.T
+        ids = np.arange(len(self.segments))
+
+        vertical = x1 == x2  #single points count as vertical segments
+        horizontal = (y1 == y2) & ~vertical
+        diagonal = ~(vertical | horizontal)
+
+        self.vertical = IntervalGroups(
+            x1[vertical], np.minimum(y1, y2)[vertical], np.maximum(y1, y2)[vertical], ids[vertical])
+        self.horizontal = IntervalGroups(
+            y1[horizontal], np.minimum(x1, x2)[horizontal], np.maximum(x1, x2)[horizontal], ids[horizontal])
+        self.diagonal_mask = diagonal
+        self._grid = None
+        self._tree = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    def contains(self, points):
+        """
+        Checks which points lie on a road segment.
+
+        Parameters:
+            points (list of tuples or array): Each point is (x, y).
+
+        Returns:
+            numpy.ndarray: Boolean mask with one entry per point.
+        """
+        return self.locate(points) >= 0
+
+    def locate(self, points):
+        """
+        Finds a road segment under each point.
+
+        Parameters:
+            points (list of tuples or array): Each point is (x, y).
+
+        Returns:
+            numpy.ndarray: Index of a segment containing each point, -1 for points off the road.
+        """
+        x, y = point_array(points).T
+        ids = self.vertical.find(x, y)
+        off_road = ids < 0
+        ids[off_road] = self.horizontal.find(y[off_road], x[off_road])
+
+        for i in np.flatnonzero(self.diagonal_mask).tolist():
+            x1, y1, x2, y2 = self.segments[i]
+            in_box = (np.minimum(x1, x2) <= x) & (x <= np.maximum(x1, x2)) & \
+                     (np.minimum(y1, y2) <= y) & (y <= np.maximum(y1, y2))
+            cross_product = (x2 - x1) * (y - y1) - (x - x1) * (y2 - y1)
+            ids[(ids < 0) & in_box & (np.abs(cross_product) < 1e-9)] = i
+        return ids
+
+    def nearest(self, points):
+        """
+        Finds the nearest road segment of each point and the closest point on it.
+
+        Points on a road get that road at distance 0, like locate. The others are
+        first searched in the cells of a SegmentGrid around them, which settles the
+        points close to a road, and the rest in a SegmentTree.
+
+        Parameters:
+            points (list of tuples or array): Each point is (x, y).
+
+        Returns:
+            tuple: (segment_ids, projected, distances) with the index of the nearest
+            segment (-1 on an empty map), the closest point on it (shape (n, 2)) and the
+            Euclidean distance to that point (infinite on an empty map).
+        """
+        points = point_array(points)
+        ids = self.locate(points)
+        projected = points.copy()
+        distances = np.zeros(len(points))
+        off_road = np.flatnonzero(ids < 0)
+        if len(off_road) and len(self.segments):
+            if self._grid is None:
+                self._grid = SegmentGrid(self.segments)
+            found, projected[off_road], distances[off_road] = self._grid.nearest(points[off_road])
+            far = off_road[found < 0]
+            ids[off_road] = found
+            if len(far):
+                if self._tree is None:
+                    self._tree = SegmentTree(self.segments)
+                ids[far], projected[far], distances[far] = self._tree.nearest(points[far])
+        else:
+            distances[off_road] = np.inf
+        return ids, projected, distances
+
+
+class SegmentGrid:
+    """
+    Grid of square cells, about as long as the segments, where every segment is
+    listed in each cell it touches, borders included. Only occupied cells are stored,
+    as sorted cell keys, so the empty space of a sparse map costs nothing.
+
+    A query looks at the cells around its point ring by ring (square rings at
+    Chebyshev distance r from the point's cell, or from the closest cell of the grid
+    for a point outside it). After ring r every segment has been seen that is closer
+    than the cells of the grid outside the square searched, so a point is settled as
+    soon as its best distance is at most its distance to those cells. A point near a
+    road is usually settled by its own cell, and a point outside the map by the cells
+    on the side of the map facing it.
+
+    Points that cannot be settled by max_rings rings are dropped as soon as that is
+    known, after the first ring: their best distance (infinite without candidates) is
+    beyond the cells outside the largest square. They are left to a SegmentTree, in
+    one batch.
+    """
+
+    max_rings = 2
+
+    def __init__(self, segments, chunk=1 << 16):
+        """
+        Parameters:
+            segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+            chunk (int): Number of points searched at a time, bounds the memory of a query.
+        """
+        self.segments = segment_array(segments)
+        self.chunk = chunk
+        lo = np.minimum(self.segments[:, :2], self.segments[:, 2:])
+        hi = np.maximum(self.segments[:, :2], self.segments[:, 2:])
+        self.origin = lo.min(axis=0)
+        self.top = hi.max(axis=0)  #the segments all lie in the box from origin to top
+        extent = float((self.top - self.origin).max())
+        self.cell = max(float((hi - lo).mean(axis=0).sum()), extent / 2**20, 1e-9)
+
+        #One entry per (segment, cell) of the box of cells it touches, grouped by cell
+        #key; a segment on the border of two cells is listed in both
+        first = np.maximum(np.ceil((lo - self.origin) / self.cell).astype(np.int64) - 1, 0)
+        last = np.floor((hi - self.origin) / self.cell).astype(np.int64)
+        self.shape = last.max(axis=0) + 1
+        width = last[:, 0] - first[:, 0] + 1
+        counts = width * (last[:, 1] - first[:, 1] + 1)
+        segment = np.repeat(np.arange(len(counts)), counts)
+        k = np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (first[segment, 0] + k % width[segment]) * self.shape[1] + first[segment, 1] + k // width[segment]
+        order = np.argsort(cells, kind="stable")
+        self.keys, starts = np.unique(cells[order], return_index=True)
+        self.offsets = np.append(starts, len(cells)).astype(np.int64)
+        self.cell_segments = segment[order]
+
+    def nearest(self, points):
+        """
+        Finds the nearest segment of the points close to a road.
+
+        Returns:
+            tuple: (segment_ids, projected, distances), as RoadIndex.nearest, with
+            segment id -1 for the points that are not settled.
+        """
+        points = point_array(points)
+        ids = np.full(len(points), -1, dtype=np.int64)
+        projected = points.copy()
+        distances = np.full(len(points), np.inf)
+        for start in range(0, len(points), self.chunk):
+            part = slice(start, start + self.chunk)
+            ids[part], projected[part], distances[part] = self._nearest(points[part])
+        return ids, projected, distances
+
+    def _nearest(self, points):
+        m = len(points)
+        best = np.full(m, np.inf)
+        best_ids = np.full(m, -1, dtype=np.int64)
+        best_points = points.copy()
+        cell = np.clip(np.floor((points - self.origin) / self.cell).astype(np.int64), 0, self.shape - 1)
+        last_reach = self._reach(points, cell, self.max_rings)
+        active = np.arange(m)
+
+        for ring in range(self.max_rings + 1):
+            #Cells of the ring around each active point, walked around the square
+            if ring == 0:
+                dx = dy = np.zeros(1, dtype=np.int64)
+            else:
+                t = np.arange(2 * ring)
+                dx = np.concatenate((t - ring, np.full(2 * ring, ring), ring - t, np.full(2 * ring, -ring)))
+                dy = np.concatenate((np.full(2 * ring, -ring), t - ring, np.full(2 * ring, ring), ring - t))
+            which = np.repeat(active, len(dx))
+            cx = (cell[active, 0][:, None] + dx).ravel()
+            cy = (cell[active, 1][:, None] + dy).ravel()
+            inside = (cx >= 0) & (cx < self.shape[0]) & (cy >= 0) & (cy < self.shape[1])
+            which, cells = which[inside], (cx * self.shape[1] + cy)[inside]
+
+            #Every segment listed in the occupied cells is a candidate
+            slot = np.minimum(np.searchsorted(self.keys, cells), len(self.keys) - 1)
+            occupied = self.keys[slot] == cells
+            which, slot = which[occupied], slot[occupied]
+            starts = self.offsets[slot]
+            counts = self.offsets[slot + 1] - starts
+            point = np.repeat(which, counts)
+            if len(point):
+                k = np.arange(len(point)) - np.repeat(np.cumsum(counts) - counts, counts)
+                segment = self.cell_segments[np.repeat(starts, counts) + k]
+
+                #Closest candidate of each point (point is sorted, one run per point),
+                #kept if it beats the best so far
+                hits = _closest_runs(point, _squared_distance(points[point], self.segments[segment]))
+                winners, segment = point[hits], segment[hits]
+                closest, distance = _project(points[winners], self.segments[segment])
+                better = distance < best[winners]
+                winners = winners[better]
+                best[winners] = distance[better]
+                best_ids[winners] = segment[better]
+                best_points[winners] = closest[better]
+
+            #Settled within the square searched, or left to the tree when the largest
+            #square cannot settle the point
+            unsettled = best[active] > self._reach(points[active], cell[active], ring)
+            if ring > 0:
+                unsettled &= best[active] <= last_reach[active]
+            active = active[unsettled]
+            if not len(active):
+                break
+
+        best_ids[best > last_reach] = -1
+        return best_ids, best_points, best
+
+    def _reach(self, points, cell, ring):
+        """
+        Distance from each point to the part of the map outside the square of ring
+        rings around its cell, infinite when the square covers the grid.
+        """
+        low = (cell - ring) * self.cell + self.origin
+        high = (cell + ring + 1) * self.cell + self.origin
+        reach = np.full(len(points), np.inf)
+        #The map beyond each side of the square is one box
+        for axis in (0, 1):
+            other = 1 - axis
+            across = np.maximum(np.maximum(self.origin[other] - points[:, other], points[:, other] - self.top[other]), 0)
+            for beyond, exists in ((points[:, axis] - low[:, axis], cell[:, axis] - ring > 0),
+                                   (high[:, axis] - points[:, axis], cell[:, axis] + ring + 1 < self.shape[axis])):
+                distance = np.hypot(np.maximum(beyond, 0), across)
+                reach = np.where(exists, np.minimum(reach, distance), reach)
+        #A hair more, so that a point next to a road lying on a cell border (grid maps)
+        #is not kept open by rounding
+        return reach + 1e-9 * self.cell
+
+
+class SegmentTree:
+    """
+    Tree of bounding boxes over the segments, for nearest-segment queries.
+
+    Segments are sorted along a Z-order curve of their midpoints and cut into leaves
+    of leaf_size consecutive segments. The leaves are paired into a complete binary
+    tree, each node keeping the bounding box of its segments.
+
+    A query walks the tree for all its points at once, one depth at a time. Every
+    side of a box touches one of its segments, so some segment is always within the
+    distance to the far end of the nearest side of a box. A node is dropped when its
+    box is further away than that bound for another box. Only a few nodes per point
+    survive at each depth, whether the point is near the roads or far outside the map.
+    """
+
+    leaf_size = 16
+
+    def __init__(self, segments, chunk=1 << 16):
+        """
+        Parameters:
+            segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+            chunk (int): Number of points searched at a time, bounds the memory of a query.
+        """
+        self.segments = segment_array(segments)
+        self.chunk = chunk
+        n = len(self.segments)
+        lo = np.minimum(self.segments[:, :2], self.segments[:, 2:])
+        hi = np.maximum(self.segments[:, :2], self.segments[:, 2:])
+
+        middle = (lo + hi) / 2
+        low = middle.min(axis=0)
+        span = np.maximum(middle.max(axis=0) - low, 1e-300)
+        grid = ((middle - low) / span * 65535).astype(np.uint64)
+        order = np.argsort(_spread_bits(grid[:, 0]) | (_spread_bits(grid[:, 1]) << np.uint64(1)), kind="stable")
+
+        #Leaves padded to a power of two with empty slots (-1, inverted boxes)
+        depth = int(np.ceil(np.log2(max(-(-n // self.leaf_size), 1))))
+        slots = 2**depth * self.leaf_size
+        self.leaf_segments = np.full(slots, -1, dtype=np.int64)
+        self.leaf_segments[:n] = order
+        box_lo = np.full((slots, 2), np.inf)
+        box_hi = np.full((slots, 2), -np.inf)
+        box_lo[:n], box_hi[:n] = lo[order], hi[order]
+
+        #Boxes of each depth, from the root (depth 0) down to the leaves
+        self.box_lo = [box_lo.reshape(-1, self.leaf_size, 2).min(axis=1)]
+        self.box_hi = [box_hi.reshape(-1, self.leaf_size, 2).max(axis=1)]
+        while len(self.box_lo[0]) > 1:
+            self.box_lo.insert(0, self.box_lo[0].reshape(-1, 2, 2).min(axis=1))
+            self.box_hi.insert(0, self.box_hi[0].reshape(-1, 2, 2).max(axis=1))
+
+    def nearest(self, points):
+        """
+        Finds the nearest segment of each point.
+
+        Returns:
+            tuple: (segment_ids, projected, distances), as RoadIndex.nearest.
+        """
+        points = point_array(points)
+        ids = np.empty(len(points), dtype=np.int64)
+        projected = np.empty((len(points), 2))
+        distances = np.empty(len(points))
+        for start in range(0, len(points), self.chunk):
+            part = slice(start, start + self.chunk)
+            ids[part], projected[part], distances[part] = self._nearest(points[part])
+        return ids, projected, distances
+
+    def _nearest(self, points):
+        m = len(points)
+        point = np.arange(m)
+        node = np.zeros(m, dtype=np.int64)
+        bound = np.full(m, np.inf)  #some segment is known to be within this squared distance
+
+        #Squared distances throughout, they keep the order and skip the square roots
+        for box_lo, box_hi in zip(self.box_lo[1:], self.box_hi[1:]):
+            point = point.repeat(2)
+            node = node.repeat(2) * 2
+            node[1::2] += 1
+            lo, hi, p = box_lo[node], box_hi[node], points[point]
+            to_lo, to_hi = p - lo, p - hi
+            to_lo *= to_lo
+            to_hi *= to_hi
+            side, end = np.minimum(to_lo, to_hi), np.maximum(to_lo, to_hi)
+            far = np.minimum(end[:, 0] + side[:, 1], side[:, 0] + end[:, 1])
+            #point stays sorted, so the nodes of each point are one run
+            starts = np.flatnonzero(np.r_[True, point[1:] != point[:-1]])
+            runs = point[starts]
+            bound[runs] = np.minimum(bound[runs], np.minimum.reduceat(far, starts))
+            gap = np.maximum(np.maximum(lo - p, p - hi), 0)
+            gap *= gap
+            keep = gap[:, 0] + gap[:, 1] <= bound[point]
+            point, node = point[keep], node[keep]
+
+        #Exact distances to the segments of the remaining leaves
+        point = point.repeat(self.leaf_size)
+        slot = (node[:, None] * self.leaf_size + np.arange(self.leaf_size)).ravel()
+        segment = self.leaf_segments[slot]
+        used = segment >= 0
+        point, segment = point[used], segment[used]
+        best = _closest_runs(point, _squared_distance(points[point], self.segments[segment]))
+        closest, distance = _project(points, self.segments[segment[best]])
+        return segment[best], closest, distance
+
+
+def _closest_runs(point, distance):
+    """Index of the smallest distance of each run of equal, sorted point ids (the first one on a tie)."""
+    starts = np.flatnonzero(np.r_[True, point[1:] != point[:-1]])
+    lengths = np.diff(np.append(starts, len(point)))
+    hits = np.flatnonzero(distance == np.repeat(np.minimum.reduceat(distance, starts), lengths))
+    return hits[np.r_[True, point[hits][1:] != point[hits][:-1]]]
+
+
+def _spread_bits(values):
+    """Spreads the 16 low bits of each value to the even bit positions, for Z-order keys."""
+    values = values & np.uint64(0xFFFF)
+    for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def find_overlapping_segments(segments):
+    """
+    Finds every pair of collinear segments that overlap, with an axis-aligned sweep.
+
+    Segments are grouped by orientation and fixed coordinate, each group is sorted by
+    interval start and scanned while keeping the intervals that are still open.
+    Touching at an endpoint is not an overlap, and single points never overlap.
+    The number of pairs can be quadratic (n copies of a segment give n(n-1)/2 pairs),
+    use first_overlap to only check a map.
+
+    Parameters:
+        segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+
+    Returns:
+        list of tuples: Sorted pairs (i, j) with i < j of overlapping segment indices.
+    """
+    ids, lo, hi, order, group_starts = _collinear_intervals(segments)
+    pairs = []
+    active = []  #heap of (hi, index) for the intervals still open in the current group
+    for k in order.tolist():
+        if group_starts[k]:
+            active = []
+        while active and active[0][0] <= lo[k]:
+            heapq.heappop(active)
+        i = ids[k]
+        for _, j in active:
+            pairs.append((min(i, j), max(i, j)))
+        heapq.heappush(active, (hi[k], i))
+
+    pairs.sort()
+    return pairs
+
+
+def first_overlap(segments):
+    """
+    Same sweep as find_overlapping_segments, but only counts the overlapping pairs and
+    keeps the smallest one, so checking a map stays O(n log n) however many pairs it has.
+
+    Parameters:
+        segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+
+    Returns:
+        tuple: (pair, count), the first pair (i, j) that find_overlapping_segments
+        would return (None if there is none) and the number of overlapping pairs.
+    """
+    ids, lo, hi, order, group_starts = _collinear_intervals(segments)
+    best = None
+    count = 0
+    active = []  #heap of (hi, index) for the intervals still open in the current group
+    smallest = []  #heap of the indices of the open intervals, closed ones are removed lazily
+    closed = set()
+    for k in order.tolist():
+        if group_starts[k]:
+            active, smallest, closed = [], [], set()
+        while active and active[0][0] <= lo[k]:
+            closed.add(heapq.heappop(active)[1])
+        while smallest and smallest[0] in closed:
+            closed.discard(heapq.heappop(smallest))
+        i = ids[k]
+        if active:
+            count += len(active)
+            #The smallest pair with i uses the smallest open index
+            j = smallest[0]
+            pair = (min(i, j), max(i, j))
+            if best is None or pair < best:
+                best = pair
+        heapq.heappush(active, (hi[k], i))
+        heapq.heappush(smallest, i)
+    return best, count
+
+
+def _collinear_intervals(segments):
+    """
+    Intervals of the horizontal and vertical segments for the overlap sweeps: segment
+    ids, interval bounds, the sweep order (by orientation, fixed
+    coordinate and interval start) and a mask of the entries opening a new group.
+    """
+    segs = segment_array(segments)
+    x1, y1, x2, y2 = segs.T
+    vertical = (x1 == x2) & (y1 != y2)
+    horizontal = (y1 == y2) & (x1 != x2)
+
+    #Orientation 0 is vertical (fixed x, interval along y), 1 is horizontal
+    ids = np.flatnonzero(vertical | horizontal)
+    orientation = horizontal[ids].astype(np.int64)
+    fixed = np.where(vertical, x1, y1)[ids]
+    lo = np.where(vertical, np.minimum(y1, y2), np.minimum(x1, x2))[ids]
+    hi = np.where(vertical, np.maximum(y1, y2), np.maximum(x1, x2))[ids]
+
+    order = np.lexsort((lo, fixed, orientation))
+    group_starts = np.ones(len(ids), dtype=bool)
+    if len(order) > 1:
+        same = (orientation[order[1:]] == orientation[order[:-1]]) & (fixed[order[1:]] == fixed[order[:-1]])
+        group_starts[order[1:]] = ~same
+    return ids.tolist(), lo.tolist(), hi.tolist(), order, group_starts.tolist()
+
+
+class TileGrid:
+    """
+    Uniform grid of square tiles over the segments, used to find what is in view.
+
+    Each segment is stored in the tile holding its midpoint. Every tile keeps the
+    bounding box of its segments and their total length, so a rectangle query only
+    looks at tiles and never at individual segments.
+    """
+
+    def __init__(self, segments, tile_size=128):
+        """
+        Parameters:
+            segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+            tile_size (float): Side of a tile in world units.
+        """
+        self.segments = segment_array(segments)
+        self.tile_size = tile_size
+        ends_lo = np.minimum(self.segments[:, :2], self.segments[:, 2:])
+        ends_hi = np.maximum(self.segments[:, :2], self.segments[:, 2:])
+        cells = np.floor((ends_lo + ends_hi) / (2 * tile_size)).astype(np.int64)
+
+        #Sort segments by tile, offsets delimit the segments of each tile
+        if len(cells):
+            span = cells[:, 1].max() - cells[:, 1].min() + 1
+            key = (cells[:, 0] - cells[:, 0].min()) * span + (cells[:, 1] - cells[:, 1].min())
+        else:
+            key = np.empty(0, dtype=np.int64)
+        self.order = np.argsort(key, kind="stable")
+        _, starts = np.unique(key[self.order], return_index=True)
+        self.offsets = np.append(starts, len(key)).astype(np.int64)
+
+        self.cells = cells[self.order][starts]
+        if len(starts):
+            self.bbox_lo = np.minimum.reduceat(ends_lo[self.order], starts, axis=0)
+            self.bbox_hi = np.maximum.reduceat(ends_hi[self.order], starts, axis=0)
+            lengths = np.abs(ends_hi - ends_lo).sum(axis=1)
+            self.lengths = np.add.reduceat(lengths[self.order], starts)
+        else:
+            self.bbox_lo = self.bbox_hi = np.empty((0, 2))
+            self.lengths = np.empty(0)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def tiles_in_rect(self, x_min, y_min, x_max, y_max):
+        """
+        Finds the tiles whose segments may intersect a rectangle.
+
+        Returns:
+            numpy.ndarray: Indices of the tiles with a bounding box touching the rectangle.
+        """
+        inside = (self.bbox_hi[:, 0] >= x_min) & (self.bbox_lo[:, 0] <= x_max) & \
+                 (self.bbox_hi[:, 1] >= y_min) & (self.bbox_lo[:, 1] <= y_max)
+        return np.flatnonzero(inside)
+
+    def segments_in_tile(self, tile):
+        """Returns the indices of the segments stored in a tile."""
+        return self.order[self.offsets[tile]:self.offsets[tile + 1]]
+
+
+def find_bridges(segments):
+    """
+    Finds the crossings (bridges) between segments that are not junctions.
+
+    A crossing is reported when two segments intersect at a point that is not an end
+    of both of them (a segment ending in the middle of another counts as well).
+    Horizontal and vertical segments are handled with a sweep over x that keeps the
+    open horizontal segments sorted by y, collinear overlaps come from
+    find_overlapping_segments. Diagonal segments, which valid maps never contain,
+    are tested pairwise.
+
+    Parameters:
+        segments (list of tuples or array): Each segment is ((x1, y1), (x2, y2)).
+
+    Returns:
+        tuple: (points, overlaps) where points is a sorted list of distinct crossing
+        points (x, y) and overlaps is a list of ((x1, y1), (x2, y2)) ranges shared by
+        two collinear segments.
+    """
+    segs = segment_array(segments)
+    x1, y1, x2, y2 = segs.T
+    vertical = (x1 == x2) & (y1 != y2)
+    horizontal = (y1 == y2) & (x1 != x2)
+    diagonal = (x1 != x2) & (y1 != y2)
+    coords = segs.tolist()
+
+    #Sweep events at each x: horizontals open (0), verticals query (1), horizontals close (2)
+    events = []
+    for i in np.flatnonzero(horizontal).tolist():
+        sx1, sy, sx2, _ = coords[i]
+        events.append((min(sx1, sx2), 0, i))
+        events.append((max(sx1, sx2), 2, i))
+    for i in np.flatnonzero(vertical).tolist():
+        events.append((coords[i][0], 1, i))
+    events.sort()
+
+    points = set()
+    open_ys = []  #sorted (y, index) of the horizontal segments crossing the sweep line
+    for x, kind, i in events:
+        if kind == 0:
+            insort(open_ys, (coords[i][1], i))
+        elif kind == 2:
+            del open_ys[bisect_left(open_ys, (coords[i][1], i))]
+        else:
+            _, vy1, _, vy2 = coords[i]
+            k = bisect_left(open_ys, (min(vy1, vy2), -1))
+            while k < len(open_ys) and open_ys[k][0] <= max(vy1, vy2):
+                y, j = open_ys[k]
+                k += 1
+                end_of_vertical = y == vy1 or y == vy2
+                end_of_horizontal = x == coords[j][0] or x == coords[j][2]
+                if not (end_of_vertical and end_of_horizontal):
+                    points.add((x, y))
+
+    #Diagonal segments against everything else
+    for i in np.flatnonzero(diagonal).tolist():
+        for j in range(len(coords)):
+            if j != i and not (diagonal[j] and j < i):
+                point = _crossing_point(coords[i], coords[j])
+                if point is not None:
+                    points.add(point)
+
+    overlaps = []
+    for i, j in find_overlapping_segments(segs):
+        ax1, ay1, ax2, ay2 = coords[i]
+        bx1, by1, bx2, by2 = coords[j]
+        if ax1 == ax2:  #vertical
+            lo = max(min(ay1, ay2), min(by1, by2))
+            hi = min(max(ay1, ay2), max(by1, by2))
+            overlaps.append(((ax1, lo), (ax1, hi)))
+        else:
+            lo = max(min(ax1, ax2), min(bx1, bx2))
+            hi = min(max(ax1, ax2), max(bx1, bx2))
+            overlaps.append(((lo, ay1), (hi, ay1)))
+    return sorted(points), overlaps
+
+
+def _squared_distance(points, segments):
+    """Squared distance from each point to the matching segment (x1, y1, x2, y2)."""
+    x1, y1, x2, y2 = segments.T
+    dx, dy = x2 - x1, y2 - y1
+    px, py = points[:, 0] - x1, points[:, 1] - y1
+    squared = dx * dx + dy * dy
+    t = np.clip((px * dx + py * dy) / np.where(squared > 0, squared, 1), 0, 1)
+    px -= t * dx
+    py -= t * dy
+    return px * px + py * py
+
+
+def _project(points, segments):
+    """Closest point of each segment (x1, y1, x2, y2) to the matching point, and the distance to it."""
+    a, direction = segments[:, :2], segments[:, 2:] - segments[:, :2]
+    squared = (direction * direction).sum(axis=1)
+    t = ((points - a) * direction).sum(axis=1) / np.where(squared > 0, squared, 1)
+    closest = a + np.clip(t, 0, 1)[:, None] * direction
+    return closest, np.hypot(*(points - closest).T)
+
+
+def _crossing_point(a, b):
+    """Crossing point of two non-parallel segments (x1, y1, x2, y2) that is not an end of both, or None."""
+    x0, y0, x1, y1 = a
+    X0, Y0, X1, Y1 = b
+    dx, dy = x0 - x1, y0 - y1
+    dX, dY = X0 - X1, Y0 - Y1
+    det = dx * dY - dy * dX
+    if det == 0:
+        return None
+    t1 = (dY * (x0 - X1) - dX * (y0 - Y1)) / det
+    t2 = (dx * (Y0 - y1) - dy * (X0 - x1)) / det
+    if 0 <= t1 <= 1 and 0 <= t2 <= 1 and (0 < t1 < 1 or 0 < t2 < 1):
+        return ((x1 - x0) * t1 + x0, (y1 - y0) * t1 + y0)
+    return None
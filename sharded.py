@@ -0,0 +1,257 @@
+#Traffic simulation split over worker processes by map tiles, with the car state in shared memory
+
+import multiprocessing
+import time
+from multiprocessing import connection, shared_memory
+
+import numpy as np
+
+from traffic import TrafficEngine
+
+
+def partition_edges(graph, num_shards, tile_size=128):
+    """
+    Splits the road graph into spatial shards made of whole map tiles.
+
+    Each edge belongs to the tile holding its midpoint. The tiles are taken row by row
+    and cut into num_shards bands holding about the same total road length, so every
+    shard is a compact area of the map and gets a similar share of the cars.
+
+    Parameters:
+        graph (RoadGraph): The compiled road graph.
+        num_shards (int): Number of shards.
+        tile_size (float): Side of the square tiles in map units.
+
+    Returns:
+        numpy.ndarray: Shard of each edge.
+    """
+    if graph.num_edges == 0:
+        return np.zeros(0, dtype=np.int64)
+    middle = (graph.nodes[graph.sources] + graph.nodes[graph.targets]) / 2
+    tile = np.floor(middle / tile_size).astype(np.int64)
+    order = np.lexsort((tile[:, 0], tile[:, 1]))
+    new_tile = np.ones(len(order), dtype=bool)
+    new_tile[1:] = (tile[order][1:] != tile[order][:-1]).any(axis=1)
+    tile_id = np.cumsum(new_tile) - 1
+
+    #Length of road before each tile decides its band
+    tile_length = np.bincount(tile_id, weights=graph.lengths[order])
+    before = np.cumsum(tile_length) - tile_length
+    tile_shard = np.minimum((before * num_shards / tile_length.sum()).astype(np.int64), num_shards - 1)
+    shard = np.empty(graph.num_edges, dtype=np.int64)
+    shard[order] = tile_shard[tile_id]
+    return shard
+
+
+class ShardedSimulation:
+    """
+    Runs a TrafficEngine in several worker processes, each one owning the cars on the
+    edges of its shard of the map (see partition_edges).
+
+    The car state (edge, offset, speed, positions) lives in shared memory arrays that
+    every worker updates in place for its own cars. Cars driving onto an edge of another
+    shard are handed off through a shared array after each step. The workers move in
+    lockstep with the coordinator, which makes this a drop-in replacement for the engine
+    in a SimulationThread: step(), positions, time and dt work the same, and positions
+    is a consistent snapshot whenever step() is not running.
+
+    The coordinator drives the workers through a pipe each and waits on the pipes and
+    the worker processes together, so a worker that crashes or is killed is noticed at
+    once, and a step taking longer than timeout is given up. step() then stops the
+    workers, releases the shared memory and raises RuntimeError instead of waiting
+    forever. Workers leave on their own when the coordinator process is gone.
+    """
+
+    def __init__(self, engine, num_workers=None, tile_size=128, timeout=60.0):
+        """
+        Parameters:
+            engine (TrafficEngine): Engine holding the map and the initial car state.
+            num_workers (int): Number of worker processes, one per CPU by default.
+            tile_size (float): Side of the map tiles the shards are made of.
+            timeout (float): Seconds to wait for the workers during a step before giving
+                up, None to wait forever.
+
+        Raises:
+            ValueError: If the engine uses a minimum gap, which needs all the cars.
+        """
+        if engine.min_gap > 0:
+            raise ValueError("\nThe sharded simulation does not support a minimum gap between cars.")
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.graph = engine.graph
+        self.dt = engine.dt
+        self.time = engine.time
+        self.timeout = timeout
+        self.shard_of_edge = partition_edges(self.graph, self.num_workers, tile_size)
+
+        n = len(engine)
+        specs = {
+            "edge": ((n,), np.int64),
+            "offset": ((n,), np.float64),
+            "speed": ((n,), np.float64),
+            "positions": ((n, 2), np.float64),
+            "handoff": ((n,), np.int64),
+            "counts": ((2, self.num_workers), np.int64),  #cars handed off, cars owned
+        }
+        self._blocks = {}
+        arrays = {}
+        for name, (shape, dtype) in specs.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            block = shared_memory.SharedMemory(create=True, size=size)
+            self._blocks[name] = block
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        self.edge, self.offset, self.speed = arrays["edge"], arrays["offset"], arrays["speed"]
+        self.positions = arrays["positions"]
+        self._owned = arrays["counts"][1]
+        self.edge[:] = engine.edge
+        self.offset[:] = engine.offset
+        self.speed[:] = engine.speed
+        self.positions[:] = engine.positions
+        arrays["counts"][0] = 0
+        arrays["counts"][1] = np.bincount(self.shard_of_edge[engine.edge], minlength=self.num_workers)
+
+        context = multiprocessing.get_context()
+        layout = {name: (block.name, specs[name]) for name, block in self._blocks.items()}
+        seeds = engine.rng.integers(2**63, size=self.num_workers)
+        self._pipes, self._workers = [], []
+        for w in range(self.num_workers):
+            pipe, worker_pipe = context.Pipe()
+            worker = context.Process(
+                target=_worker,
+                args=(w, self.graph, self.shard_of_edge, layout, worker_pipe, int(seeds[w])),
+                daemon=True)
+            worker.start()
+            worker_pipe.close()  #so a dead worker shows up as a broken pipe here
+            self._pipes.append(pipe)
+            self._workers.append(worker)
+
+    def __len__(self):
+        return len(self.edge)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def step(self, dt=None):
+        """
+        Advances all cars by dt (the engine's dt by default) across all workers.
+
+        Raises:
+            RuntimeError: If a worker has stopped or the step took longer than the timeout,
+                the simulation is closed then.
+        """
+        if not self._workers:
+            raise RuntimeError("\nThe sharded simulation is closed.")
+        dt = self.dt if dt is None else dt
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        self._ask(("move", dt), deadline)  #step the own cars and hand off the leaving ones
+        self._owned[:] = self._ask(("take", None), deadline)  #take over the handed cars
+        self.time += dt
+
+    def close(self):
+        """Stops the workers and releases the shared memory."""
+        for pipe in self._pipes:
+            try:
+                pipe.send(None)
+            except OSError:
+                pass  #the worker is gone already
+        for worker in self._workers:
+            worker.join(self.timeout)
+            if worker.is_alive():
+                worker.kill()
+                worker.join()
+        for pipe in self._pipes:
+            pipe.close()
+        self._pipes, self._workers = [], []
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks = {}
+
+    def _ask(self, message, deadline):
+        #Sends the message to every worker and waits for all the answers, failing on a
+        #worker that stops or on the deadline
+        answers = [None] * len(self._pipes)
+        waiting = {pipe: w for w, pipe in enumerate(self._pipes)}
+        stopped = {worker.sentinel: w for w, worker in enumerate(self._workers)}
+        try:
+            for pipe in self._pipes:
+                pipe.send(message)
+            while waiting:
+                left = None if deadline is None else max(deadline - time.monotonic(), 0)
+                ready = connection.wait(list(waiting) + list(stopped), left)
+                if not ready:
+                    self._fail(f"\nThe simulation workers did not finish a step within {self.timeout} seconds.")
+                if any(item in stopped for item in ready):
+                    self._fail("\nA simulation worker stopped during the step.")
+                for item in ready:
+                    answers[waiting.pop(item)] = item.recv()
+        except (OSError, EOFError) as error:
+            self._fail("\nLost the connection to a simulation worker.", error)
+        return answers
+
+    def _fail(self, message, error=None):
+        #Stops all the workers at once, as the step cannot be finished anyway
+        failed = [(w, worker.exitcode) for w, worker in enumerate(self._workers) if not worker.is_alive()]
+        if failed:
+            message += " Worker {} ended with exit code {}.".format(*failed[0])
+        for worker in self._workers:
+            worker.kill()
+        self.close()
+        raise RuntimeError(message) from error
+
+
+def _attach(layout):
+    #Maps the shared blocks into this process, the coordinator unlinks them at the end
+    blocks, arrays = [], {}
+    for name, (block_name, (shape, dtype)) in layout.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+
+def _worker(w, graph, shard_of_edge, layout, pipe, seed):
+    """Step loop of one worker process, owning the cars on the edges of shard w."""
+    blocks, arrays = _attach(layout)
+    edge, offset, speed = arrays["edge"], arrays["offset"], arrays["speed"]
+    positions, handoff = arrays["positions"], arrays["handoff"]
+    handed, owned = arrays["counts"]
+    engine = TrafficEngine(graph, [], [], seed=seed)  #only used for its tables and rng
+    mine = np.flatnonzero(shard_of_edge[edge] == w)
+    coordinator = multiprocessing.parent_process().sentinel
+
+    while True:
+        if pipe not in connection.wait([pipe, coordinator]):
+            break  #the coordinator process is gone
+        message = pipe.recv()
+        if message is None:
+            break
+        task, dt = message
+
+        if task == "move":
+            #Step the own cars and write out the ones leaving the shard. Each worker
+            #writes into its own region of the handoff array, sized by the cars it owns.
+            car_edge, car_offset = edge[mine], offset[mine] + speed[mine] * dt
+            engine._turn(car_edge, car_offset)
+            edge[mine], offset[mine] = car_edge, car_offset
+            positions_out = np.empty((len(mine), 2))
+            engine._place(car_edge, car_offset, positions_out)
+            positions[mine] = positions_out
+            leaving = shard_of_edge[car_edge] != w
+            region = int(owned[:w].sum())
+            handed[w] = leaving.sum()
+            handoff[region:region + handed[w]] = mine[leaving]
+            mine = mine[~leaving]
+            pipe.send(None)
+        else:
+            #Take over the cars handed to this shard by the others. The coordinator sets
+            #the new counts once everyone has read the handoffs.
+            regions = np.concatenate(([0], np.cumsum(owned)[:-1]))
+            incoming = np.concatenate([handoff[regions[v]:regions[v] + handed[v]] for v in range(len(owned))])
+            mine = np.concatenate((mine, incoming[shard_of_edge[edge[incoming]] == w]))
+            pipe.send(len(mine))
+
+    for block in blocks:
+        block.close()
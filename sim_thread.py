@@ -0,0 +1,133 @@
+#Fixed-timestep simulation running in its own thread, decoupled from the window
+
+import threading
+import time
+
+import numpy as np
+
+
+class SimulationThread(threading.Thread):
+    """
+    Runs a TrafficEngine at a fixed timestep in a worker thread.
+
+    After every step the car positions are copied into a ring of three buffers and
+    published together with the previous snapshot, so readers never wait for the step
+    loop: a reader checks the step counter instead of taking a lock, and interpolates
+    between the two latest snapshots to draw smooth motion at any frame rate.
+
+    If a step fails with a RuntimeError (a sharded engine losing a worker) the loop
+    ends and keeps the error in error, the last snapshot stays readable.
+    """
+
+    def __init__(self, engine, dt=None, time_scale=1.0, realtime=True, max_catch_up=5):
+        """
+        Parameters:
+            engine (TrafficEngine): The engine to step.
+            dt (float): Simulated time per step, the engine's dt by default.
+            time_scale (float): Simulated seconds per real second when running in real time.
+            realtime (bool): Pace the steps to the wall clock, False runs as fast as possible.
+            max_catch_up (int): Steps run back to back before dropping time when the
+                simulation falls behind the wall clock.
+        """
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.dt = engine.dt if dt is None else dt
+        self.time_scale = time_scale
+        self.realtime = realtime
+        self.max_catch_up = max_catch_up
+        self.steps = 0
+        self.error = None
+        self._stop_event = threading.Event()
+
+        self._buffers = [engine.positions.copy() for _ in range(3)]
+        now = time.perf_counter()
+        #(step, previous time, previous positions, time, positions, wall clock at publication)
+        self._snapshot = (0, engine.time, self._buffers[0], engine.time, self._buffers[0], now)
+
+    def run(self):
+        step_wall = self.dt / self.time_scale
+        next_step = time.perf_counter()
+        while not self._stop_event.is_set():
+            try:
+                self.engine.step(self.dt)
+            except RuntimeError as error:
+                self.error = error
+                return
+            self._publish()
+            if self.realtime:
+                next_step += step_wall
+                delay = next_step - time.perf_counter()
+                if delay > 0:
+                    self._stop_event.wait(delay)
+                elif -delay > self.max_catch_up * step_wall:
+                    next_step = time.perf_counter()  #too far behind, drop the lost time
+
+    def stop(self):
+        """Stops the step loop and waits for the thread to finish."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def advance(self, duration):
+        """
+        Runs the simulation for a simulated duration in the calling thread without any
+        pacing, as fast as the engine allows (for headless runs, do not start the thread).
+
+        Returns:
+            int: Number of steps taken.
+        """
+        steps = int(round(duration / self.dt))
+        for _ in range(steps):
+            self.engine.step(self.dt)
+            self._publish()
+        return steps
+
+    def _publish(self):
+        #Write into the buffer that the current snapshot does not refer to, then swap
+        #references. The counter goes up before writing so readers can detect reuse.
+        self.steps += 1
+        back = self._buffers[self.steps % 3]
+        np.copyto(back, self.engine.positions)
+        _, _, _, last_time, last_positions, _ = self._snapshot
+        self._snapshot = (
+            self.steps, last_time, last_positions, self.engine.time, back, time.perf_counter())
+
+    def read_positions(self, out=None, interpolate=True):
+        """
+        Reads the latest car positions without blocking the step loop.
+
+        Parameters:
+            out (numpy.ndarray): Optional (N, 2) array to write the positions into.
+            interpolate (bool): Blend the two latest snapshots according to the time
+                elapsed since the last one, for smooth drawing between steps.
+
+        Returns:
+            numpy.ndarray: The (N, 2) car positions.
+        """
+        if out is None:
+            out = np.empty_like(self._buffers[0])
+        while True:
+            step, previous_time, previous, current_time, current, published = self._snapshot
+            alpha = 1.0
+            if interpolate and self.realtime and current_time > previous_time:
+                elapsed = (time.perf_counter() - published) * self.time_scale
+                alpha = min(elapsed / (current_time - previous_time), 1.0)
+            if alpha >= 1.0:
+                np.copyto(out, current)
+            else:
+                np.subtract(current, previous, out=out)
+                out *= alpha
+                out += previous
+            #The oldest buffer of a snapshot is only rewritten two steps later
+            if self.steps - step <= 1:
+                return out
+
+    def updatecar(self, carposition, carspeed, segments):
+        """
+        Hook for SimWindow.show: copies the latest (interpolated) positions into the
+        cars shown by the window, the simulation itself keeps running in this thread.
+        """
+        if isinstance(carposition, np.ndarray):
+            self.read_positions(out=carposition)
+        else:
+            carposition[:] = map(tuple, self.read_positions().tolist())
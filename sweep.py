@@ -0,0 +1,204 @@
+#Parallel, resumable sweep of batch scenarios over seeds, map sizes and car counts
+
+"""
+Runs every (seed, segments, cars) combination through batch.run_scenario on a process
+pool. Each result is appended to a JSON Lines file as soon as it finishes, so an
+interrupted sweep resumes where it stopped when run again with the same output file.
+
+Examples:
+    python sweep.py --seeds 0:10000 --segments 100,1000 --cars 0 --output sweep.jsonl
+    python sweep.py --seeds 0:100 --segments 1000 --cars 500,5000 --simulate 10 --output sim.jsonl
+    python sweep.py --summary sweep.jsonl
+"""
+
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from batch import run_scenario
+
+
+def scenario_key(scenario):
+    """Identifies a scenario in the output file."""
+    return (scenario["seed"], scenario["segments"], scenario["cars"], scenario["simulate"])
+
+
+def make_scenarios(seeds, segment_counts, car_counts, simulate=0.0):
+    """
+    Builds the list of scenarios of a sweep, every combination of the given values.
+
+    Returns:
+        list of dicts: Scenarios with the keys seed, segments, cars and simulate.
+    """
+    return [
+        {"seed": seed, "segments": segments, "cars": cars, "simulate": simulate}
+        for segments, cars, seed in itertools.product(segment_counts, car_counts, seeds)
+    ]
+
+
+def load_results(file_path):
+    """
+    Reads the results already in an output file. A last line cut short by an
+    interruption is ignored, the scenario it belonged to is simply run again.
+
+    Returns:
+        list of dicts: The complete results in the file (empty if it does not exist).
+    """
+    results = []
+    if not os.path.exists(file_path):
+        return results
+    with open(file_path, 'r') as file:
+        for line in file:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return results
+
+
+def _run(scenario):
+    """Runs one scenario in a worker process."""
+    result = run_scenario(num_segments=scenario["segments"], num_cars=scenario["cars"],
+                          seed=scenario["seed"], simulate=scenario["simulate"])
+    result.pop("positions", None)
+    result["scenario"] = scenario
+    return result
+
+
+def run_sweep(scenarios, output, workers=None, report=True):
+    """
+    Runs the scenarios that are not in the output file yet and appends their results.
+
+    A scenario whose worker raises gets an error result with the exception text, and
+    the sweep goes on. Such a result is marked "worker_failed" and run again by the
+    next sweep on the same file (a killed worker breaks the pool for every scenario
+    still queued, not only its own).
+
+    Parameters:
+        scenarios (list of dicts): Scenarios from make_scenarios.
+        output (str): JSON Lines file the results are appended to.
+        workers (int): Number of worker processes, one per CPU by default.
+        report (bool): Print the progress.
+
+    Returns:
+        list of dicts: All results of the scenarios, including the earlier ones.
+    """
+    done = {scenario_key(r["scenario"]): r for r in load_results(output) if "scenario" in r}
+    todo = [s for s in scenarios if scenario_key(s) not in done or done[scenario_key(s)].get("worker_failed")]
+    if report:
+        print(f"{len(scenarios)} scenarios, {len(scenarios) - len(todo)} already done, {len(todo)} to run.")
+
+    cut_short = _last_byte(output) not in (b"", b"\n")
+    with open(output, 'a') as file, ProcessPoolExecutor(max_workers=workers) as pool:
+        if cut_short:
+            file.write("\n")  #the interrupted line stays on its own and is ignored
+        futures = {pool.submit(_run, scenario): scenario for scenario in todo}
+        for count, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as error:
+                result = {"scenario": futures[future], "status": "error", "worker_failed": True,
+                          "timings": {}, "messages": [f"{type(error).__name__}: {str(error).strip()}"]}
+            file.write(json.dumps(result) + "\n")
+            file.flush()  #each result is on disk as soon as it is known
+            done[scenario_key(result["scenario"])] = result
+            if report and (count % 100 == 0 or count == len(todo)):
+                print(f"{count}/{len(todo)} scenarios done.")
+    return [done[scenario_key(s)] for s in scenarios if scenario_key(s) in done]
+
+
+def _last_byte(file_path):
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        return b""
+    with open(file_path, 'rb') as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1)
+
+
+def summarize(results):
+    """
+    Aggregates sweep results per (segments, cars) group.
+
+    Returns:
+        list of dicts: For each group, the number of runs, the count of each status,
+        the validity rate and the mean, median and 95th percentile time of each stage.
+    """
+    groups = {}
+    for result in results:
+        scenario = result["scenario"]
+        groups.setdefault((scenario["segments"], scenario["cars"]), []).append(result)
+
+    summary = []
+    for (segments, cars), group in sorted(groups.items()):
+        statuses = {}
+        for result in group:
+            statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+        stages = {}
+        for result in group:
+            for stage, seconds in result["timings"].items():
+                stages.setdefault(stage, []).append(seconds)
+        summary.append({
+            "segments": segments,
+            "cars": cars,
+            "runs": len(group),
+            "statuses": statuses,
+            "valid_rate": statuses.get("ok", 0) / len(group),
+            "timings": {stage: _stats(times) for stage, times in stages.items()},
+        })
+    return summary
+
+
+def _stats(values):
+    values = sorted(values)
+    return {
+        "mean": statistics.fmean(values),
+        "median": statistics.median(values),
+        "p95": values[min(len(values) - 1, int(0.95 * len(values)))],
+    }
+
+
+def print_summary(summary):
+    """Prints the aggregate statistics of a sweep."""
+    for group in summary:
+        statuses = ", ".join(f"{status} {count}" for status, count in sorted(group["statuses"].items()))
+        print(f"\n{group['segments']} segments, {group['cars']} cars: {group['runs']} runs, "
+              f"{group['valid_rate']:.2%} valid ({statuses})")
+        for stage, stats in group["timings"].items():
+            print(f"    {stage:<14} mean {stats['mean'] * 1000:9.2f} ms   median {stats['median'] * 1000:9.2f} ms"
+                  f"   p95 {stats['p95'] * 1000:9.2f} ms")
+
+
+def _int_list(text):
+    """Parses "1,2,3" or a range "start:stop" into a list of integers."""
+    if ":" in text:
+        start, stop = text.split(":")
+        return list(range(int(start), int(stop)))
+    return [int(value) for value in text.split(",") if value]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel, resumable sweep of map_sim scenarios.")
+    parser.add_argument("--seeds", type=_int_list, default=[0], help="seeds as a,b,c or start:stop")
+    parser.add_argument("--segments", type=_int_list, default=[100], help="segment counts as a,b,c")
+    parser.add_argument("--cars", type=_int_list, default=[0], help="car counts as a,b,c")
+    parser.add_argument("--simulate", type=float, default=0.0, help="simulated time of each run")
+    parser.add_argument("--workers", type=int, help="worker processes, one per CPU by default")
+    parser.add_argument("--output", default="sweep.jsonl", help="JSON Lines file of the results")
+    parser.add_argument("--summary", metavar="FILE", help="only print the statistics of an existing output file")
+    args = parser.parse_args(argv)
+
+    if args.summary:
+        results = [r for r in load_results(args.summary) if "scenario" in r]
+    else:
+        scenarios = make_scenarios(args.seeds, args.segments, args.cars, args.simulate)
+        results = run_sweep(scenarios, args.output, args.workers)
+    print_summary(summarize(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+#Checks that the core module and the menu start fast and without the GUI or the simulation
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks import IMPORT_BUDGET, measure_import
+
+
+@pytest.mark.parametrize("module", ["map_core", "map_sim"])
+def test_import_is_within_budget(module):
+    result = measure_import(module, repeat=3)
+    assert not result["gui_modules"], result
+    assert result["seconds"] <= IMPORT_BUDGET, result
+
+
+def test_menu_does_not_load_the_simulation():
+    #The traffic engine and the shared memory workers are only imported by menu option 2
+    code = ("import sys, map_sim\n"
+            "print(','.join(m for m in ('traffic', 'sim_thread', 'sharded', 'multiprocessing.shared_memory')"
+            " if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    assert output.strip() == ""
@@ -0,0 +1,25 @@
+#Checks the bulk file loader on files without any data
+
+import warnings
+
+from loaders import load_array
+
+
+def test_blank_files_load_without_warnings(tmp_path):
+    for text in ["", "\n\n\n", " \n\t\n", "# only a comment\n\n"]:
+        path = tmp_path / "segments.txt"
+        path.write_text(text)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            values, skipped = load_array(str(path), 4)
+        assert values.shape == (0, 4) and skipped == []
+
+
+def test_blank_chunks_between_data_are_skipped(tmp_path):
+    #Small chunks make some of them hold nothing but blank lines
+    path = tmp_path / "segments.txt"
+    path.write_text("1,2,3,4\n" + "\n" * 50 + "5,6,7,8\n")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        values, skipped = load_array(str(path), 4, chunk_bytes=8)
+    assert values.tolist() == [[1, 2, 3, 4], [5, 6, 7, 8]] and skipped == []
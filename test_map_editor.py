@@ -0,0 +1,62 @@
+#Checks that EditableMap.is_valid agrees with the validator of map_core
+
+import contextlib
+import io
+import random
+
+from map_core import are_segments_connected, generate_grid_city
+from map_editor import EditableMap
+
+
+def validate(editable):
+    #are_segments_connected prints its errors, only the answer is compared
+    with contextlib.redirect_stdout(io.StringIO()):
+        return are_segments_connected(editable.to_road_map())
+
+
+def test_one_way_roads_are_not_valid():
+    #Both roads end at (1, 0), the second one cannot be reached from the first
+    editable = EditableMap([((0, 0), (1, 0)), ((2, 0), (1, 0))])
+    assert editable.is_joined()
+    assert not editable.is_valid()
+    assert not validate(editable)
+
+
+def test_random_edits_match_validator():
+    directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    for seed in range(200):
+        rng = random.Random(seed)
+        editable = EditableMap()
+        ids = []
+        for step in range(60):
+            if ids and rng.random() < 0.35:
+                editable.remove_segment(ids.pop(rng.randrange(len(ids))))
+            else:
+                x, y = rng.randrange(5), rng.randrange(5)
+                length = rng.randrange(4)
+                dx, dy = rng.choice(directions)
+                try:
+                    ids.append(editable.add_segment(((x, y), (x + dx*length, y + dy*length))))
+                except ValueError:
+                    pass  #diagonal or overlapping
+            #Some edits are not checked, so several of them pile up between two answers
+            if len(editable) and step % 3 != 0:
+                assert editable.is_valid() == validate(editable), (seed, step)
+
+
+def test_removing_reached_segments_of_a_grid_matches_validator():
+    #Every street of a grid city is reached, so each removal repairs the tree of parents
+    editable = EditableMap(generate_grid_city(2000, missing_group_rate=0.3, seed=1))
+    assert editable.is_valid()
+    rng = random.Random(1)
+    removed = []
+    for step in range(400):
+        if removed and rng.random() < 0.4:
+            editable.add_segment(removed.pop(rng.randrange(len(removed))))
+        else:
+            removed.append(editable.remove_segment(rng.choice(list(editable.segments))))
+        if step % 4 == 0:
+            assert editable.is_valid() == validate(editable), step
+    for segment in removed:
+        editable.add_segment(segment)
+    assert editable.is_valid() == validate(editable)
@@ -0,0 +1,234 @@
+#Headless traffic simulation: cars driving along the road graph
+
+import numpy as np
+
+from generators import sample_along
+from lanes import LaneOccupancy
+from road_graph import RoadGraph
+from road_index import RoadIndex, point_array
+
+
+class TrafficEngine:
+    """
+    Vectorized traffic engine keeping the cars as NumPy arrays (struct of arrays).
+
+    Cars drive along the edges of the compiled RoadGraph: every car is on an edge, at a
+    distance (offset) from the start of that edge, and drives towards its end at its own
+    speed. At the end of an edge the car moves on to a random edge leaving the junction,
+    read straight from the CSR arrays; at a dead end it waits at the end. With a minimum
+    gap, cars queue behind the car ahead on their edge instead of passing through it.
+    A whole step for all cars is a handful of array operations.
+    """
+
+    def __init__(self, graph, edge_ids, offsets, speeds=1.0, dt=1.0, seed=None, min_gap=0.0):
+        """
+        Parameters:
+            graph (RoadGraph, list of tuples or array): The road graph, or the segments
+                to compile it from, each segment is ((x1, y1), (x2, y2)).
+            edge_ids (array): Graph edge of each car.
+            offsets (array): Distance of each car from the start of its edge.
+            speeds (float or array): Speed of each car in units per unit of time, >= 0.
+            dt (float): Time advanced by each call to updatecar.
+            seed (int): Seed for the choice of the next edge at junctions.
+            min_gap (float): Minimum distance kept to the car ahead on the same edge,
+                0 lets cars drive through each other.
+        """
+        self.graph = graph if isinstance(graph, RoadGraph) else RoadGraph(graph)
+        self.segments = self.graph.segments
+        self.lengths = self.graph.lengths
+        starts = self.graph.nodes[self.graph.sources]
+        directions = (self.graph.nodes[self.graph.targets] - starts) / self.lengths[:, None]
+        self._x0, self._y0 = starts[:, 0].copy(), starts[:, 1].copy()
+        self._ux, self._uy = directions[:, 0].copy(), directions[:, 1].copy()
+        #Edges leaving the end of each edge are the CSR row of its target node
+        self._next_first = self.graph.offsets[self.graph.targets]
+        self._next_degree = self.graph.offsets[self.graph.targets + 1] - self._next_first
+        self._dead_end_limit = np.where(self._next_degree == 0, self.lengths, np.inf)
+
+        self.edge = np.array(edge_ids, dtype=np.int64)
+        self.offset = np.array(offsets, dtype=float)
+        self.speed = np.broadcast_to(np.asarray(speeds, dtype=float), self.edge.shape).copy()
+        self.dt = dt
+        self.time = 0.0
+        self.rng = np.random.default_rng(seed)
+        self.positions = np.empty((len(self.edge), 2))
+        self.min_gap = min_gap
+        #Cars sorted along each edge, only kept up to date when a spacing rule is used
+        self.lanes = LaneOccupancy(self.edge, self.offset, self.graph.num_edges) if min_gap > 0 else None
+        self._update_positions()
+
+    @classmethod
+    def from_positions(cls, segments, cars, speeds=1.0, dt=1.0, seed=None, min_gap=0.0):
+        """
+        Creates an engine with the cars at the given (x, y) positions.
+
+        Parameters:
+            segments (RoadGraph, list of tuples or array): The road graph or segments.
+
+        Raises:
+            ValueError: If a car is not on any road segment.
+        """
+        graph = segments if isinstance(segments, RoadGraph) else RoadGraph(segments)
+        segs = graph.segments
+        cars = point_array(cars)
+        segment_ids = RoadIndex(segs).locate(cars)
+        if (segment_ids < 0).any():
+            car = cars[int(np.argmin(segment_ids))]
+            raise ValueError(f"\nCar at position {tuple(car)} is not on any valid road segment.")
+        offsets = np.abs(cars - segs[segment_ids, :2]).sum(axis=1)
+        edge_ids, edge_offsets = graph.locate(segment_ids, offsets)
+        if (edge_ids < 0).any():
+            car = cars[int(np.argmin(edge_ids))]
+            raise ValueError(f"\nCar at position {tuple(car)} is on a road of zero length.")
+        return cls(graph, edge_ids, edge_offsets, speeds=speeds, dt=dt, seed=seed, min_gap=min_gap)
+
+    @classmethod
+    def random(cls, segments, num_cars, speeds=1.0, dt=1.0, seed=None, min_gap=0.0):
+        """
+        Creates an engine with cars placed uniformly along the roads.
+
+        Parameters:
+            segments (RoadGraph, list of tuples or array): The road graph or segments.
+            num_cars (int): Number of cars.
+        """
+        graph = segments if isinstance(segments, RoadGraph) else RoadGraph(segments)
+        if graph.num_edges == 0:
+            raise ValueError("\nCars can only be placed on a map with at least one road of non-zero length.")
+        rng = np.random.default_rng(seed)
+        edge_ids, offsets = sample_along(graph.lengths, num_cars, rng)
+        return cls(graph, edge_ids, offsets, speeds=speeds, dt=dt, seed=rng, min_gap=min_gap)
+
+    def __len__(self):
+        return len(self.edge)
+
+    @property
+    def segment(self):
+        """Road segment of each car."""
+        return self.graph.edge_segment.take(self.edge)
+
+    def _update_positions(self):
+        self._place(self.edge, self.offset, self.positions)
+
+    def _place(self, edge, offset, out):
+        #(x, y) points of the cars at the given edges and offsets, written into out
+        out[:, 0] = self._x0.take(edge) + offset * self._ux.take(edge)
+        out[:, 1] = self._y0.take(edge) + offset * self._uy.take(edge)
+
+    @property
+    def velocities(self):
+        """Velocity (vx, vy) of each car, as an (N, 2) array."""
+        return np.column_stack((self._ux.take(self.edge), self._uy.take(self.edge))) \
+            * self.speed[:, None]
+
+    def step(self, dt=None):
+        """
+        Advances all cars by dt (the engine's dt by default).
+
+        Cars that pass the end of their edge continue on a random edge leaving its end
+        junction, several times in one step if they are fast or the edges are short.
+        With a minimum gap a car turns at most once per step, only if there is room
+        behind the last car on the next edge, and never moves backwards.
+        """
+        dt = self.dt if dt is None else dt
+        if self.lanes is None:
+            self.offset += self.speed * dt
+            self._turn(self.edge, self.offset)
+        else:
+            self._step_with_gap(dt)
+            self.lanes.update(self.edge, self.offset)
+        self.time += dt
+        self._update_positions()
+
+    def _step_with_gap(self, dt):
+        #Queue behind the car ahead, in the order of the last step (cars are still on
+        #the same edges here), and in front of dead ends
+        previous = self.offset
+        offset = previous + self.speed * dt
+        np.minimum(offset, self._dead_end_limit.take(self.edge), out=offset)
+        offset = self.lanes.keep_gap(self.min_gap, offset)
+
+        lengths = self.lengths.take(self.edge)
+        leaving = np.flatnonzero(offset > lengths)
+        staying = np.ones(len(offset), dtype=bool)
+        if len(leaving):
+            held = self._enter(leaving, offset)
+            staying[leaving] = False
+            staying[held] = True
+            if len(held):
+                #Cars without room wait at the end of their edge, the cars behind them queue again
+                offset[held] = lengths[held]
+                queue = np.where(staying, offset, np.inf)
+                offset[staying] = self.lanes.keep_gap(self.min_gap, queue)[staying]
+        #A car only ever waits, the corrections never push it back along its edge
+        offset[staying] = np.maximum(offset[staying], previous[staying])
+        self.offset = offset
+
+    def _enter(self, leaving, offset):
+        """
+        Moves the cars past the end of their edge (in place) onto a random next edge,
+        behind the last car already on it and min_gap apart from each other.
+
+        Returns:
+            numpy.ndarray: The cars that found no room, they stay on their edge.
+        """
+        current = self.edge[leaving]
+        #Dead ends were cut above, every leaving car has a next edge
+        target = self._next_first[current] + (self.rng.random(len(leaving)) * self._next_degree[current]).astype(np.int64)
+        entry = np.minimum(offset[leaving] - self.lengths[current], self.lengths[target])
+
+        #Room behind the last car of the target edge (offsets only grow during a step)
+        last = self.lanes.first_at_or_after(target, np.zeros(len(target)))
+        occupied = last >= 0
+        rear = np.full(len(target), np.inf)
+        rear[occupied] = np.minimum(offset[last[occupied]], self.lengths[target[occupied]])
+        entry = np.minimum(entry, rear - self.min_gap)
+
+        #The entering cars queue behind each other, after one blocker per occupied target
+        #standing for its last car
+        blocked, first = np.unique(target[occupied], return_index=True)
+        lanes, lane_of = np.unique(np.concatenate((target, blocked)), return_inverse=True)
+        queue = LaneOccupancy(lane_of, np.concatenate((entry, rear[occupied][first])), len(lanes))
+        spaced = queue.keep_gap(self.min_gap)
+        queue.update(lane_of, spaced)
+        fits = (entry >= 0) & (queue.headway()[:len(leaving)] >= self.min_gap * (1 - 1e-9))
+
+        entering = leaving[fits]
+        self.edge[entering] = target[fits]
+        offset[entering] = spaced[:len(leaving)][fits]
+        return leaving[~fits]
+
+    def _turn(self, edge, offset):
+        #Moves the cars past the end of their edge (in place) onto a random next edge,
+        #several times if they are fast or the edges are short
+        over = np.flatnonzero(offset > self.lengths.take(edge))
+        while len(over):
+            current = edge[over]
+            first = self._next_first[current]
+            degree = self._next_degree[current]
+
+            #Dead ends: wait at the end of the edge
+            dead = degree == 0
+            offset[over[dead]] = self.lengths[current[dead]]
+
+            over, current, first, degree = over[~dead], current[~dead], first[~dead], degree[~dead]
+            offset[over] -= self.lengths[current]
+            edge[over] = first + (self.rng.random(len(over)) * degree).astype(np.int64)
+            over = over[offset[over] > self.lengths.take(edge[over])]
+
+    def updatecar(self, carposition, carspeed, segments):
+        """
+        Hook for SimWindow.show: advances the simulation by one step and writes the
+        new positions (and velocities) into the lists or arrays shown by the window.
+        Passing engine.positions as the cars of SimWindow avoids any copy.
+        """
+        self.step()
+        if carposition is not self.positions:
+            if isinstance(carposition, np.ndarray):
+                carposition[:] = self.positions
+            else:
+                carposition[:] = map(tuple, self.positions.tolist())
+        if carspeed is not None:
+            if isinstance(carspeed, np.ndarray):
+                carspeed[:] = self.velocities
+            else:
+                carspeed[:] = map(tuple, self.velocities.tolist())